@@ -12,6 +12,9 @@ import os
 # Import the ConvVAE and ResNet
 import sys
 sys.path.insert(0, "./models")
+sys.path.insert(0, "./utils")
+from dataset_split import train_test_split
+from shared_dataset import attach_or_load
 from ConvVAE import ConvVAE
 from ResNet import ResNet
 from ConvDisc_LeakyReLU import ConvDisc_LeakyReLU as ConvDisc
@@ -29,15 +32,17 @@ from train_VAE_GAN import train_VAE_GAN
 print("[STATE]: Loading data onto context")
 print('[STATE]: Random seed chosen is 0')
 mx.random.seed(0)
-all_features = nd.load('../project_data/anime_faces.ndy')[0]
-all_features = nd.shuffle(all_features)
-
-# Use 80% of the data as training data
-# since the anime faces have no particular order, just take the first
-# 80% as training set
-n_train = int(all_features.shape[0] * 0.8)
-train_features = all_features[0:n_train]
-test_features = all_features[n_train:]
+# Attach to the copy of the dataset published in shared memory by a
+# parallel sweep (see utils/shared_dataset.py) if there is one
+all_features = attach_or_load('../project_data/anime_faces.ndy')
+
+# Use a random 80% of the data as training data and the rest as test set;
+# the split is a seeded permutation of the indices that is saved next to the
+# dataset, so every run uses the same split without copying the data
+train_features, test_features = train_test_split(all_features,
+                                                 '../project_data/anime_faces.ndy',
+                                                 train_fraction=0.8,
+                                                 seed=0)
 batch_size = 64
 _, n_channels, width, height = train_features.shape
 
@@ -3,18 +3,18 @@ import mxnet as mx
 from mxnet import nd, gluon
 from mxnet.gluon import nn, loss as gloss
 import numpy as np
-import d2l
-CTX = d2l.try_gpu()
+from utilities import decode_at_size, make_to_rgb_heads
 
 # A gluon block that is the decoder of ConvVAE
 
-class ConvDecoder(gluon.Block):
+class ConvDecoder(gluon.HybridBlock):
     
     def __init__(self, n_latent = 512,
                  n_channels = 3,
                  out_width = 64,
                  out_height = 64,
-                 n_base_channels = 16):
+                 n_base_channels = 16,
+                 progressive_sizes = ()):
         super(ConvDecoder, self).__init__()
         
         # Store some of the hyper paramteres
@@ -24,6 +24,13 @@ class ConvDecoder(gluon.Block):
         self.out_height = out_height
         self.n_base_channels = n_base_channels
         
+        # For progressive training the decoder can also output the square
+        # intermediate resolutions in progressive_sizes (e.g. (16, 32)) through
+        # their own output heads; out_size selects the resolution the decoder
+        # currently outputs, None being out_width x out_height
+        self.progressive_sizes = list(progressive_sizes)
+        self.out_size = None
+        
         # Construct the decoder network
         with self.name_scope():
             
@@ -32,7 +39,7 @@ class ConvDecoder(gluon.Block):
             # of shape (batch_size, n_latent, 1, 1)
             # Decoder's architecture came from Deep Convolutional
             # Generative Adversarial Network tutorial from MXNet
-            self.decoder = nn.Sequential(prefix='decoder')
+            self.decoder = nn.HybridSequential(prefix='decoder')
             # Add convolution layers with decreasing number of channels
             self.decoder.add(nn.Conv2DTranspose(n_base_channels*8, 4, 1, 0, use_bias=False),
                              nn.BatchNorm(),
@@ -51,32 +58,21 @@ class ConvDecoder(gluon.Block):
             self.decoder.add(nn.Conv2DTranspose(self.n_channels, 4, 2, 1, use_bias=False),
                              nn.Activation('sigmoid'))
             
-    def forward(self, x):
+            # Output heads of the intermediate resolutions
+            self.to_rgb = make_to_rgb_heads(self.progressive_sizes, n_channels)
+            
+    @property
+    def out_size(self):
+        return self._out_size
+    
+    @out_size.setter
+    def out_size(self, out_size):
+        # The resolution decides which layers are in the graph, so a
+        # hybridized decoder has to rebuild its graph when it changes
+        self._out_size = out_size
+        self._clear_cached_op()
+            
+    def hybrid_forward(self, F, x):
         # x must be 4-dimensional array of shape (batch_size, n_latent, 1, 1)
         
-        return self.decoder(x)
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+        return decode_at_size(self.decoder, self.to_rgb, self.progressive_sizes, x, self.out_size)
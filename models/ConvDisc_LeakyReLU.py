@@ -2,7 +2,7 @@ import mxnet as mx
 from mxnet import nd, gluon, init
 from mxnet.gluon import nn
 
-class ConvDisc_LeakyReLU(gluon.Block):
+class ConvDisc_LeakyReLU(gluon.HybridBlock):
     
     def __init__(self, n_classes=1,
                 n_base_channels=32):
@@ -13,7 +13,7 @@ class ConvDisc_LeakyReLU(gluon.Block):
         self.n_base_channels = n_base_channels
         
         with self.name_scope():
-            self.discriminator = nn.Sequential(prefix='discriminator')
+            self.discriminator = nn.HybridSequential(prefix='discriminator')
             
             self.discriminator.add(nn.Conv2D(n_base_channels, 4, 2, 1, use_bias=False),
                                    nn.LeakyReLU(0.2))
@@ -25,7 +25,7 @@ class ConvDisc_LeakyReLU(gluon.Block):
                                    nn.LeakyReLU(0.2))
             self.discriminator.add(nn.Dense(n_classes))
             
-    def forward(self, x):
+    def hybrid_forward(self, F, x):
         # input x has shape
         # x.shape = (batch_size, n_channels, width, height)
         
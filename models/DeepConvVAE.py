@@ -3,20 +3,20 @@ import mxnet as mx
 from mxnet import nd, gluon
 from mxnet.gluon import nn, loss as gloss
 import numpy as np
-import d2l
-CTX = d2l.try_gpu()
+from utilities import decode_at_size, make_to_rgb_heads, resize_img_batch
 
 # A variational autoencoder whose autoencoder uses convolutional 
 # layers
 
-class DeepConvVAE(gluon.Block):
+class DeepConvVAE(gluon.HybridBlock):
     
     def __init__(self, n_latent = 5,
                 n_channels = 3,
                 out_width = 64,
                 out_height = 64,
                 n_base_channels = 16,
-                pbp_weight=1):
+                pbp_weight=1,
+                progressive_sizes=()):
         super(DeepConvVAE, self).__init__()
         
         # Record the model hyperparameters
@@ -27,12 +27,19 @@ class DeepConvVAE(gluon.Block):
         self.n_base_channels = n_base_channels
         self.pbp_weight = pbp_weight
         
+        # For progressive training the decoder can also output the square
+        # intermediate resolutions in progressive_sizes (e.g. (16, 32)) through
+        # their own output heads; out_size selects the resolution the model
+        # currently works at, None being out_width x out_height
+        self.progressive_sizes = list(progressive_sizes)
+        self.out_size = None
+        
         
         # Construct the encoder and decoder network
         with self.name_scope():
             
             # Construct the encoder network
-            self.encoder = nn.Sequential(prefix='encoder')
+            self.encoder = nn.HybridSequential(prefix='encoder')
             # Add convolution layers with increasing number of channels
             self.encoder.add(nn.Conv2D(n_base_channels * 1, kernel_size=4, use_bias=False),
                              nn.BatchNorm(),
@@ -54,7 +61,7 @@ class DeepConvVAE(gluon.Block):
             # of shape (batch_size, n_latent, 1, 1)
             # Decoder's architecture came from Deep Convolutional
             # Generative Adversarial Network tutorial from MXNet
-            self.decoder = nn.Sequential(prefix='decoder')
+            self.decoder = nn.HybridSequential(prefix='decoder')
             # Add convolution layers with decreasing number of channels
             self.decoder.add(nn.Conv2DTranspose(64*8, 4, 1, 0, use_bias=False),
                              nn.BatchNorm(),
@@ -73,110 +80,83 @@ class DeepConvVAE(gluon.Block):
             self.decoder.add(nn.Conv2DTranspose(self.n_channels, 4, 2, 1, use_bias=False),
                              nn.Activation('sigmoid'))
             
-    def forward(self, x):
-        # Because this encoder decoder setup uses convolutional layers 
-        # There is no need to flatten anything
-        # x.shape = (batch_size, n_channels, width, height)
+            # Output heads of the intermediate resolutions
+            self.to_rgb = make_to_rgb_heads(self.progressive_sizes, n_channels)
+            
+    @property
+    def pbp_weight(self):
+        return self._pbp_weight
+    
+    @pbp_weight.setter
+    def pbp_weight(self, pbp_weight):
+        # The weight is a constant of the compiled graph, so a hybridized
+        # model has to rebuild its graph when it changes
+        self._pbp_weight = pbp_weight
+        self._clear_cached_op()
+    
+    @property
+    def out_size(self):
+        return self._out_size
+    
+    @out_size.setter
+    def out_size(self, out_size):
+        # The resolution decides which layers are in the graph
+        self._out_size = out_size
+        self._clear_cached_op()
+    
+    def _reconstruct(self, F, x):
+        # Encode x, draw the latent variable with the reparametrization trick
+        # and decode it; return x_hat, the latent means and the latent log
+        # vars. x.shape = (batch_size, n_channels, width, height)
         
-        # Get the latent layer
-        latent_layer = self.encoder(x)
+        # Get the latent layer; the encoder always works at full resolution,
+        # so smaller images are scaled up first
+        latent_layer = self.encoder(resize_img_batch(x, self.out_width, self.out_height,
+                                                     self.out_size or self.out_width,
+                                                     self.out_size or self.out_height, F))
         
         # Split the latent layer into latent means and latent log vars
-        latent_mean = nd.split(latent_layer, axis=1, num_outputs=2)[0]
-        latent_logvar = nd.split(latent_layer, axis=1, num_outputs=2)[1]
+        latent_mean, latent_logvar = F.split(latent_layer, axis=1, num_outputs=2)
         
         # Compute the latent variable with reparametrization trick applied
-        eps = nd.random_normal(0, 1, shape=(x.shape[0], self.n_latent), ctx=CTX)
-        latent_z = latent_mean + nd.exp(0.5 * latent_logvar) * eps
-        
-        # Compute the KL Divergence between latent variable and standard normal
-        kl_div_loss = -0.5 * nd.sum(1 + latent_logvar - latent_mean * latent_mean - nd.exp(latent_logvar),
-                                         axis=1)
+        eps = F.random.normal_like(latent_mean)
+        latent_z = latent_mean + F.exp(0.5 * latent_logvar) * eps
         
         # Use the decoder to generate output
-        x_hat = self.decoder(latent_z.reshape((x.shape[0], self.n_latent, 1, 1)))
+        x_hat = decode_at_size(self.decoder, self.to_rgb, self.progressive_sizes,
+                               F.reshape(latent_z, shape=(0, -1, 1, 1)), self.out_size)
+        return x_hat, latent_mean, latent_logvar
+            
+    def hybrid_forward(self, F, x):
+        # Because this encoder decoder setup uses convolutional layers 
+        # There is no need to flatten anything
+        # x.shape = (batch_size, n_channels, width, height)
+        x_hat, latent_mean, latent_logvar = self._reconstruct(F, x)
         
-        # Compute the pixel-by-pixel loss; this requires that x and x_hat be flattened
-        x_flattened = x.reshape((x.shape[0], -1))
-        x_hat_flattened = x_hat.reshape((x_hat.shape[0], -1))
-        logloss = - nd.sum(x_flattened*nd.log(x_hat_flattened + 1e-10) +
-                                (1-x_flattened)*nd.log(1-x_hat_flattened+1e-10),
-                                axis=1)
+        # The losses are reduced in float32 even when the layers run in
+        # reduced precision (see the precision option of training_engine.py)
+        latent_mean = F.amp_cast(latent_mean, dtype='float32')
+        latent_logvar = F.amp_cast(latent_logvar, dtype='float32')
+        
+        # Compute the KL Divergence between latent variable and standard normal
+        kl_div_loss = -0.5 * F.sum(1 + latent_logvar - latent_mean * latent_mean - F.exp(latent_logvar),
+                                   axis=1)
         
-        # Sum up the loss
+        # Compute the pixel-by-pixel loss; this requires that x and x_hat be flattened
+        x_flattened = F.flatten(x)
+        x_hat_flattened = F.amp_cast(F.flatten(x_hat), dtype='float32')
+        logloss = - F.sum(x_flattened*F.log(x_hat_flattened + 1e-10) +
+                          (1-x_flattened)*F.log(1-x_hat_flattened+1e-10),
+                          axis=1)
+        
+        # Sum up the loss; x_hat is returned with it so that a training step
+        # can use the reconstructions without running the VAE again
         loss = kl_div_loss + logloss * self.pbp_weight
         
-        return loss
+        return loss, x_hat
     
     def generate(self, x):
         # Generate an image given the input
         # input is
         # x.shape = (batch_size, n_channels, width, height)
-        
-        # Get the latent layer
-        latent_layer = self.encoder(x)
-        
-        # Split the latent layer into latent means and latent log vars
-        latent_mean = nd.split(latent_layer, axis=1, num_outputs=2)[0]
-        latent_logvar = nd.split(latent_layer, axis=1, num_outputs=2)[1]
-        
-        # Compute the latent variable with reparametrization trick applied
-        eps = nd.random_normal(0, 1, shape=(x.shape[0], self.n_latent), ctx=CTX)
-        latent_z = latent_mean + nd.exp(0.5 * latent_logvar) * eps
-        
-        # Use the decoder to generate output
-        x_hat = self.decoder(latent_z.reshape((x.shape[0], self.n_latent, 1, 1)))
-        return x_hat
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
+        return self._reconstruct(nd, x)[0]
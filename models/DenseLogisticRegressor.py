@@ -3,11 +3,9 @@ import mxnet as mx
 from mxnet import nd, gluon
 from mxnet.gluon import nn, loss as gloss
 import numpy as np
-import d2l
-CTX = d2l.try_gpu()
 
 # This will be a simple logistic regression discriminator
-class DenseLogisticRegressor(gluon.Block):
+class DenseLogisticRegressor(gluon.HybridBlock):
     
     def __init__(self, n_hlayers = 0,
                  n_hnodes = 10,
@@ -17,7 +15,7 @@ class DenseLogisticRegressor(gluon.Block):
         
         # Construct the simple logistic regression network
         with self.name_scope():
-            self.discriminator = nn.Sequential()
+            self.discriminator = nn.HybridSequential()
             
             for hlayer in range(n_hlayers):
                 self.discriminator.add(nn.Dense(n_hnodes, activation='relu'))
@@ -28,11 +26,11 @@ class DenseLogisticRegressor(gluon.Block):
             # the loss function is computed (with from_sigmoid = False)
             self.discriminator.add(nn.Dense(n_classes))
             
-    def forward(self, x):
+    def hybrid_forward(self, F, x):
         # The input data is 4-dimensional image arrays, but the dimensionalities
         # don't really matter; the input array will simply be flattened into
         # shape (n_batch, n_pixels)
-        x_flattened = x.reshape((x.shape[0], -1))
+        x_flattened = F.flatten(x)
         
         # Feed the input into the network
         logit_preds = self.discriminator(x_flattened)
@@ -3,21 +3,23 @@ import mxnet as mx
 from mxnet import nd, gluon
 from mxnet.gluon import nn, loss as gloss
 import numpy as np
-import d2l
-CTX = d2l.try_gpu()
 
-# This script provides a subclass of gluon.Block that is the
+# This script provides a subclass of gluon.HybridBlock that is the
 # VAE network. The implementation is identical to that of the demo
 # provided in https://gluon.mxnet.io/chapter13_unsupervised-learning/vae-gluon.html
 
-class DenseVAE(gluon.Block):
+class DenseVAE(gluon.HybridBlock):
     
     def __init__(self, n_latent = 2,
                  n_hlayers = 3,
                  n_hnodes = 400,
                  n_out_channels = 1,
                  out_width = 28,
-                 out_height = 28):
+                 out_height = 28,
+                 pbp_weight = 1):
+        
+        # Initialize the super class
+        super(DenseVAE, self).__init__()
         
         # Store some hyperparameters
         self.n_latent = n_latent
@@ -26,13 +28,11 @@ class DenseVAE(gluon.Block):
         self.n_out_channels = n_out_channels
         self.out_width = out_width
         self.out_height = out_height
-        
-        # Initialize the super class
-        super(DenseVAE, self).__init__()
+        self.pbp_weight = pbp_weight
         
         # Define the networks: encoder and decoder
         with self.name_scope():
-            self.encoder = nn.Sequential(prefix='encoder')
+            self.encoder = nn.HybridSequential(prefix='encoder')
             
             # The input of encoder networks are images so they will be of the
             # shape (n_batch, n_channels, width, height)
@@ -51,7 +51,7 @@ class DenseVAE(gluon.Block):
             self.encoder.add(nn.Dense(2 * n_latent))
             
             # Define the decoder network
-            self.decoder = nn.Sequential(prefix='decoder')
+            self.decoder = nn.HybridSequential(prefix='decoder')
             
             # The input of decoder network is latent space NDArray of shape
             # (n_batch, n_latent)
@@ -63,72 +63,67 @@ class DenseVAE(gluon.Block):
             self.decoder.add(nn.Dense(self.n_out_channels * self.out_width * self.out_height,
                                       activation='sigmoid'))
             
-    def forward(self, x):
-        # x is input of shape (n_batch, n_channels, width, height)
-        batch_size = x.shape[0]
-        x = x.reshape(batch_size, -1)
-        
+    @property
+    def pbp_weight(self):
+        return self._pbp_weight
+    
+    @pbp_weight.setter
+    def pbp_weight(self, pbp_weight):
+        # The weight is a constant of the compiled graph, so a hybridized
+        # model has to rebuild its graph when it changes
+        self._pbp_weight = pbp_weight
+        self._clear_cached_op()
+    
+    def _reconstruct(self, F, x):
+        # Encode x, draw the latent variable with the reparametrization trick
+        # and decode it; return the flat x_hat, the latent means and the
+        # latent log vars
         
-        # Get the latent layer
+        # Get the latent layer; the Dense layers flatten x themselves
         latent_layer = self.encoder(x)
         
         # Split the latent layer into latent means and latent log vars
-        latent_mean = nd.split(latent_layer, axis=1, num_outputs = 2)[0]
-        latent_logvar = nd.split(latent_layer, axis=1, num_outputs = 2)[1]
+        latent_mean, latent_logvar = F.split(latent_layer, axis=1, num_outputs=2)
         
         # Use the reparametrization trick to ensure differentiability of the latent
         # variable
-        eps = nd.random_normal(loc=0,
-                               scale=1,
-                               shape=(batch_size, self.n_latent),
-                              ctx=CTX)
-        latent_z = latent_mean + nd.exp(0.5 * latent_logvar) * eps
+        eps = F.random.normal_like(latent_mean)
+        latent_z = latent_mean + F.exp(0.5 * latent_logvar) * eps
         
         # Use the decoder to generate output
-        x_hat = self.decoder(latent_z)        
+        return self.decoder(latent_z), latent_mean, latent_logvar
+    
+    def hybrid_forward(self, F, x):
+        # x is input of shape (n_batch, n_channels, width, height)
+        x = F.flatten(x)
+        x_hat, latent_mean, latent_logvar = self._reconstruct(F, x)
+        
+        # The losses are reduced in float32 even when the layers run in
+        # reduced precision (see the precision option of training_engine.py)
+        latent_mean = F.amp_cast(latent_mean, dtype='float32')
+        latent_logvar = F.amp_cast(latent_logvar, dtype='float32')
+        x_hat_float32 = F.amp_cast(x_hat, dtype='float32')
         
         # Compute the KL_Divergence between latent variable and standard normal
-        self.KL_div_loss = -0.5 * nd.sum(1 + latent_logvar - latent_mean * latent_mean - nd.exp(latent_logvar),
+        kl_div_loss = -0.5 * F.sum(1 + latent_logvar - latent_mean * latent_mean - F.exp(latent_logvar),
                                    axis=1)
         
         # Compute the content loss that is the cross entropy between the original image 
         # and the generated image
-        # content_loss = gloss.SigmoidBinaryCrossEntropyLoss(from_sigmoid=True)(x_hat, x.reshape(batch_size, -1))
-        
         # Add 1e-10 to prevent log(0) from happening
-        self.logloss = - nd.sum(x*nd.log(x_hat + 1e-10)+ (1-x)*nd.log(1-x_hat + 1e-10), axis=1)
+        logloss = - F.sum(x*F.log(x_hat_float32 + 1e-10)+ (1-x)*F.log(1-x_hat_float32 + 1e-10), axis=1)
         
         # Try l2 loss, too
-        # self.l2loss = nd.sum((x_hat - x) ** 2, axis = 1)
+        # l2loss = F.sum((x_hat - x) ** 2, axis = 1)
         
-        # Sum up the loss
-        loss = self.KL_div_loss + self.logloss
-        return loss
+        # Sum up the loss; x_hat is returned with it, in the shape of the
+        # images, so that a training step can use the reconstructions without
+        # running the VAE again
+        loss = kl_div_loss + logloss * self.pbp_weight
+        return loss, F.reshape(x_hat, shape=(0, self.n_out_channels, self.out_width, self.out_height))
     
     def generate(self, x):
-        # Because forward() returns the loss values, we still need a method that returns the generated image
+        # Because forward() returns the loss values, we still need a method that returns only the generated image
         # Which is basically the forward process, up to (not including) the flattening of x_hat
-        
-        # x should be image arrays (4-dimensional) but encoder should be able 
-        # to handle this so I am not going flatten it
-        
-        # Use the encoder network to compute the values of latent layers
-        latent_layer = self.encoder(x)
-        
-        # Split the latent layer into latent means and latent log vars
-        latent_mean = nd.split(latent_layer, axis=1, num_outputs = 2)[0]
-        latent_logvar = nd.split(latent_layer, axis=1, num_outputs = 2)[1]
-        
-        # Use the reparametrization trick to ensure differentiability of the latent
-        # variable
-        eps = nd.random_normal(loc=0,
-                               scale=1,
-                               shape=(x.shape[0], self.n_latent),
-                              ctx=CTX)
-        latent_z = latent_mean + nd.exp(0.5 * latent_logvar) * eps
-        
-        # Use the decoder to generate output, then flatten it to compute loss
-        return self.decoder(latent_z).reshape(-1, self.n_out_channels, self.out_width, self.out_height)
-            
-            
-            
\ No newline at end of file
+        x_hat = self._reconstruct(nd, x)[0]
+        return x_hat.reshape((-1, self.n_out_channels, self.out_width, self.out_height))
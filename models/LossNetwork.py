@@ -9,23 +9,27 @@ import os
 
 
 class LossNet(Block):
-    def __init__(self, vgg, content_weight, style_weight, batch_size, loss=gluon.loss.L2Loss()):
+    def __init__(self, vgg, content_weight, style_weight, batch_size, loss=gluon.loss.L2Loss(),
+                 img_statistics=None):
         super(LossNet, self).__init__()
         self.vgg = vgg
         self.content_weight = content_weight
         self.style_weight = style_weight
         self.batch_size = batch_size
         self.loss = loss
+        # Dataset statistics saved by the converter, as loaded by
+        # utils/dataset_statistics.load_statistics
+        self.img_statistics = img_statistics if img_statistics is not None else {}
 
     def forward(self, original_img, generated_img):
         # normalization:
-        x = utils.subtract_img_mean_batch(original_img)
-        y = utils.subtract_img_mean_batch(generated_img)
+        x = utilities.subtract_img_mean_batch(original_img, **self.img_statistics)
+        y = utilities.subtract_img_mean_batch(generated_img, **self.img_statistics)
 
         features_x = self.vgg(x)
         features_y = self.vgg(y)
 
-        gram_style = [self.gram_matrix(feature) for feature in featured_x]
+        gram_style = [self.gram_matrix(feature) for feature in features_x]
 
         # compute content loss:
         vgg_x = features_x[1]
@@ -4,7 +4,7 @@ from mxnet.gluon import nn
 
 # The residual block implementation is directly taken from 
 # D2L's website at http://d2l.ai/chapter_convolutional-modern/resnet.html
-class Residual(gluon.Block):
+class Residual(gluon.HybridBlock):
     def __init__(self, num_channels, use_1x1conv=False, strides=1, **kwargs):
         super(Residual, self).__init__(**kwargs)
         self.conv1 = nn.Conv2D(num_channels, kernel_size=3, padding=1,
@@ -18,16 +18,21 @@ class Residual(gluon.Block):
         self.bn1 = nn.BatchNorm()
         self.bn2 = nn.BatchNorm()
 
-    def forward(self, X):
-        Y = nd.relu(self.bn1(self.conv1(X)))
+    def hybrid_forward(self, F, X):
+        Y = F.relu(self.bn1(self.conv1(X)))
         Y = self.bn2(self.conv2(Y))
         if self.conv3:
             X = self.conv3(X)
-        return nd.relu(Y + X)
+        return F.relu(Y + X)
     
 # The implementation of a ResNet is taken from the D2L website
 # at http://d2l.ai/chapter_convolutional-modern/resnet.html
-class ResNet(gluon.Block):
+class ResNet(gluon.HybridBlock):
+    
+    # The global average pooling makes the output independent of the input
+    # resolution, so progressive training can feed it smaller images
+    resolution_agnostic = True
+    
     def __init__(self, n_classes = 1):
         super(ResNet, self).__init__()
         
@@ -35,7 +40,7 @@ class ResNet(gluon.Block):
         # It is really sad how I need to implement nested method but I don't know
         # of better ways
         def resnet_block(num_channels, num_residuals, first_block=False):
-            blk = nn.Sequential()
+            blk = nn.HybridSequential()
             for i in range(num_residuals):
                 if i == 0 and not first_block:
                     blk.add(Residual(num_channels, use_1x1conv=True, strides=2))
@@ -46,7 +51,7 @@ class ResNet(gluon.Block):
         
         with self.name_scope():
             # Construct the network
-            self.resnet = nn.Sequential()
+            self.resnet = nn.HybridSequential()
             
             # As specified on the website we begin with a 7*7 convolution
             # with 64 output channels, followed by batch normalization,
@@ -70,7 +75,7 @@ class ResNet(gluon.Block):
             # 
             self.resnet.add(nn.GlobalAvgPool2D(), nn.Dense(n_classes))
             
-    def forward(self, x):
+    def hybrid_forward(self, F, x):
         # x is image NDArray that is
         # x.shape = (batch_size, n_channels, width, height)
         #
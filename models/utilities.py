@@ -1,4 +1,77 @@
-def subtract_img_mean_batch(x):
-	""" TODO: implement this function
+import math
+from mxnet import nd
+from mxnet.gluon import nn
+
+def subtract_img_mean_batch(x, mean=None, std=None, mean_image=None):
+	""" Normalize a batch of images with precomputed dataset statistics, as
+	loaded by utils/dataset_statistics.load_statistics. The batch is
+	(batch_size, n_channels, width, height) in the stored layout.
+
+	With mean_image, the mean image is subtracted from every image. With mean
+	(and optionally std), every value has its channel mean subtracted (and is
+	divided by the channel std); the stored images are reshaped pixel arrays,
+	so the channel is the last axis of x.reshape((0, -1, n_channels)).
+	Without statistics the batch is returned unchanged.
 	"""
-	return x
+	if mean_image is not None:
+		return nd.broadcast_sub(x, mean_image)
+	if mean is None:
+		return x
+	pixels = x.reshape((0, -1, mean.shape[-1]))
+	if std is None:
+		return nd.broadcast_sub(pixels, mean).reshape_like(x)
+	return nd.broadcast_div(nd.broadcast_sub(pixels, mean), std).reshape_like(x)
+
+def resize_img_batch(x, width, height, in_width=None, in_height=None, F=nd):
+	""" Resize a batch of images in the stored layout, i.e. (batch_size,
+	n_channels, width, height) arrays that are reshaped (width, height,
+	n_channels) pixel arrays, to width x height. The resizing is done in the
+	real pixel layout: block means for shrinking and nearest neighbours for
+	growing, by integer factors.
+
+	Inside hybrid_forward, where x is a Symbol without a shape, pass the input
+	size as in_width and in_height and the operator namespace as F.
+	"""
+	if in_width is None:
+		_, _, in_width, in_height = x.shape
+	if (in_width, in_height) == (width, height):
+		return x
+	images = F.transpose(F.reshape(x, shape=(0, in_width, in_height, -1)), axes=(0, 3, 1, 2))
+	if width > in_width:
+		images = F.UpSampling(images, scale=width // in_width, sample_type='nearest')
+	else:
+		factor = in_width // width
+		images = F.Pooling(images, kernel=(factor, factor), stride=(factor, factor), pool_type='avg')
+	return F.reshape(F.transpose(images, axes=(0, 2, 3, 1)), shape=(0, -1, width, height))
+
+def make_to_rgb_heads(progressive_sizes, n_channels):
+	""" Build the output heads of a progressively trained decoder: one 1x1
+	convolution followed by a sigmoid for every intermediate resolution in
+	progressive_sizes. With no progressive sizes the container is empty, so
+	the parameters of the model are the same as without progressive training.
+	"""
+	to_rgb = nn.HybridSequential(prefix='to_rgb')
+	for _ in progressive_sizes:
+		head = nn.HybridSequential()
+		head.add(nn.Conv2D(n_channels, kernel_size=1, use_bias=False),
+				 nn.Activation('sigmoid'))
+		to_rgb.add(head)
+	return to_rgb
+
+def decode_at_size(decoder, to_rgb, progressive_sizes, z, out_size=None):
+	""" Run a DCGAN style decoder, whose first block of (Conv2DTranspose,
+	BatchNorm, relu) outputs 4x4 and every further block doubles the
+	resolution, only up to out_size and finish with the to_rgb head of that
+	size. With out_size None (or the full size) the whole decoder is run.
+	Only the blocks are called, so z may be an NDArray or a Symbol.
+
+	The blocks and heads that a resolution skips cannot infer their shapes
+	from its graph, so the model has to be run once at every resolution
+	(as training_engine.py does after initializing it) before it is trained.
+	"""
+	if out_size is None or out_size not in progressive_sizes:
+		return decoder(z)
+	n_blocks = int(round(math.log(out_size / 4., 2))) + 1
+	for i in range(3 * n_blocks):
+		z = decoder[i](z)
+	return to_rgb[progressive_sizes.index(out_size)](z)
@@ -0,0 +1,14 @@
+#!/bin/bash
+
+# Run the seeded anime trainings concurrently. The dataset is published once
+# into shared memory and every training attaches to it read-only instead of
+# loading its own copy of anime_faces.ndy (see utils/shared_dataset.py)
+python utils/shared_dataset.py publish ../project_data/anime_faces.ndy || exit 1
+trap 'python utils/shared_dataset.py unpublish anime_faces' EXIT
+
+python train_DenseVAE_on_anime.py &
+python train_DenseVAE_DenseLogReg_on_anime.py &
+python train_ConvVAE_on_anime.py &
+python train_ConvVAE_ConvDisc_LeakyReLU_on_anime.py &
+python train_ConvVAE_ResNet_on_anime.py &
+wait
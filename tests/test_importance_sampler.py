@@ -0,0 +1,51 @@
+import os
+import sys
+import numpy as np
+from mxnet import nd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from dataset_split import SubsetDataset
+from importance_sampler import ImportanceBatchIterator, LossImportanceSampler
+from memmap_dataset import MemmapImageDataset, create_memmap
+
+# A sampled batch must hold the images of the split at the drawn indices,
+# as float values in [0, 1], whatever the split's features are stored as
+
+
+def make_images(n_samples=40):
+    return np.random.RandomState(0).randint(0, 256, size=(n_samples, 3, 4, 4)).astype(np.uint8)
+
+
+def as_float(sample):
+    if isinstance(sample, nd.NDArray):
+        sample = sample.asnumpy()
+    return np.asarray(sample, dtype=np.float32) / 255.
+
+
+def check_sampled_batches(split):
+    sampler = LossImportanceSampler(len(split), batch_size=8, seed=0)
+    for batch, indices, _ in ImportanceBatchIterator(split, sampler):
+        expected = np.stack([as_float(split[int(i)]) for i in indices.asnumpy()])
+        assert batch.dtype == np.float32
+        np.testing.assert_allclose(batch.asnumpy(), expected, rtol=0, atol=1e-6)
+
+
+def test_resident_uint8_split():
+    features = nd.array(make_images(), dtype=np.uint8)
+    check_sampled_batches(SubsetDataset(features, np.arange(39, 9, -1)))
+
+
+def test_memmap_split(tmp_path):
+    path = str(tmp_path / 'images.u8')
+    output = create_memmap(path, (40, 3, 4, 4))
+    output[:] = make_images()
+    output.flush()
+    del output
+    check_sampled_batches(SubsetDataset(MemmapImageDataset(path), np.arange(39, 9, -1)))
+
+
+def test_coreset_of_split():
+    # A subset of a train split, as for a coreset of it
+    features = nd.array(make_images(), dtype=np.uint8)
+    train_split = SubsetDataset(features, np.random.RandomState(1).permutation(40)[:30])
+    check_sampled_batches(SubsetDataset(train_split, [3, 7, 11, 19, 23, 29]))
@@ -12,18 +12,30 @@ import matplotlib.pyplot as plt
 import sys
 sys.path.insert(0, "./models")
 from DenseLogisticRegressor import DenseLogisticRegressor
+sys.path.insert(0, "./utils")
+from mnist_cache import load_mnist
+from gather_iterator import GatherIterator
+from loss_accumulator import LossAccumulator
 
 # Prepare the training data and training data iterator
 # Note that we are going to train on only the images of digits 0 and 1
-mnist = mx.test_utils.get_mnist()
-train_features = nd.array(mnist['train_data'][mnist['train_label'] < 2], ctx=CTX)
-train_labels = nd.array(mnist['train_label'][mnist['train_label'] < 2], ctx=CTX)
+# MNIST is read from the local cache (see utils/mnist_cache.py) binarized
+# and bit-packed; the packed images stay resident on CTX at 1 bit per pixel
+mnist_images, mnist_labels = load_mnist('train', binarized=True)
+rows = np.nonzero(mnist_labels < 2)[0]
+train_features = mnist_images.to_resident(ctx=CTX, rows=rows)
+train_labels = nd.array(mnist_labels[rows], ctx=CTX)
 batch_size = 64
-train_dataset = gdata.ArrayDataset(train_features, train_labels)
-train_iter = gdata.DataLoader(train_dataset,
-                                  batch_size,
-                                 shuffle=True,
-                                 last_batch='keep')
+# Every batch is gathered from the resident features and labels with a
+# single nd.take and unpacked on CTX
+train_iter = GatherIterator((train_features, train_labels),
+                            batch_size,
+                            shuffle=True)
+# The training accuracy is computed batch by batch as well, so the images
+# are never all unpacked at once
+eval_iter = GatherIterator((train_features, train_labels),
+                           1024,
+                           shuffle=False)
 
 # Instantiate the model, initialize the parameters, and instantiate the trainer
 log_reg = DenseLogisticRegressor(n_hlayers = 1)
@@ -41,7 +53,8 @@ loss_func = gloss.SigmoidBinaryCrossEntropyLoss(from_sigmoid=False)
 n_epochs = 50
 for epoch in range(n_epochs):
     
-    batch_losses = []
+    # Batch losses stay on the device until the end of the epoch
+    batch_losses = LossAccumulator()
     
     for batch_features, batch_labels in train_iter:
         batch_features = batch_features.as_in_context(CTX)
@@ -50,14 +63,17 @@ for epoch in range(n_epochs):
         with autograd.record():
             logit_preds = log_reg(batch_features)
             loss = loss_func(logit_preds, batch_labels)
-            batch_losses.append(nd.mean(loss).asscalar())
+            batch_losses.add(loss)
             loss.backward()
             
         log_reg_trainer.step(batch_features.shape[0])
         
-    epoch_train_loss = np.mean(batch_losses)
-    train_preds = nd.round(nd.sigmoid(log_reg(train_features))).reshape((-1,))
-    train_acc = nd.mean(train_preds == train_labels).asscalar()
+    epoch_train_loss = batch_losses.mean()
+    n_correct = 0
+    for batch_features, batch_labels in eval_iter:
+        batch_preds = nd.round(nd.sigmoid(log_reg(batch_features))).reshape((-1,))
+        n_correct = n_correct + nd.sum(batch_preds == batch_labels)
+    train_acc = (n_correct / len(rows)).asscalar()
     
     epoch_report_str = 'Epoch{}, Training loss {:.10f}, Training accuracy {:.3f}'.format(epoch,
                                                                                  epoch_train_loss,
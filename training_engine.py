@@ -0,0 +1,875 @@
+# Import the basic packages
+import inspect
+from contextlib import contextmanager
+import mxnet as mx
+from mxnet import nd, gluon, autograd
+from mxnet.gluon import data as gdata, loss as gloss
+from mxnet.contrib import amp
+import numpy as np
+import d2l
+import time
+import matplotlib.pyplot as plt
+
+# Import the input pipeline helpers
+import sys
+sys.path.insert(0, "./models")
+sys.path.insert(0, "./utils")
+from prefetch_iterator import PrefetchIterator
+from gather_iterator import GatherIterator, resident_arrays
+from importance_sampler import ImportanceBatchIterator, LossImportanceSampler
+from loss_accumulator import LossAccumulator
+from buffer_pool import BufferPool
+from dataset_split import SubsetDataset, train_test_split
+from memmap_dataset import MemmapImageDataset
+from record_dataset import RecordDataset
+from compressed_image_dataset import CompressedImageDataset
+from pyramid_dataset import open_pyramid
+from shared_dataset import attach_or_load
+from mnist_cache import load_mnist
+from utilities import resize_img_batch
+
+# One training engine for every experiment in this repository. An
+# experiment is a declarative config (a dict) that names the networks, the
+# dataset, the training phases, the optimizer and where the results go;
+# every experiment runs through the same batch loop, so anything that makes
+# that loop faster benefits all of them at once.
+#
+# The engine has three modes:
+#   'vae'     - a VAE trained on its own loss
+#   'vae_gan' - a VAE trained against a discriminator; the first
+#               n_solo_epochs train the VAE alone with a pixel-by-pixel
+#               weight of 1, the remaining (combo) epochs add the
+#               discriminator loss to the VAE loss
+#   'gan'     - a generator (e.g. ConvDecoder) that maps latent noise of
+#               shape (batch_size, n_latent, 1, 1) to images, trained
+#               against a discriminator
+#
+# A config only needs the entries that differ from DEFAULT_CONFIG; every
+# section is merged over its defaults. The generator and discriminator are
+# either gluon.Block instances or dicts such as
+#   {'class': ConvVAE, 'n_latent': 512, 'n_base_channels': 32}
+# whose image shape arguments (n_channels / n_out_channels, out_width,
+# out_height) are filled in from the dataset when they are left out.
+#
+# Usage:
+#   from training_engine import train
+#   train({'mode': 'vae', 'generator': {'class': ConvVAE, ...}, ...})
+
+DEFAULT_CONFIG = {
+    'mode': 'vae_gan',
+    # Seed of mx.random set before anything else; None leaves it alone
+    'seed': 0,
+    'ctx': None,
+    'dataset': {
+        # Where the images come from; every source but 'mnist' is split into
+        # train and test sets with the permutation saved next to path:
+        #   'anime'    the float32 NDArray saved at path (or its shared memory
+        #              copy, see utils/shared_dataset.py)
+        #   'memmap'   the uint8 memmap file at path (utils/memmap_dataset.py)
+        #   'records'  the record directory at path (utils/record_dataset.py)
+        #   'images'   the image folder, zip or tar archive at path, decoded
+        #              on demand (utils/compressed_image_dataset.py)
+        #   'mnist'    the local MNIST cache (utils/mnist_cache.py)
+        # Setting train_features and test_features skips loading altogether
+        'source': 'anime',
+        'path': '../project_data/anime_faces.ndy',
+        'train_fraction': 0.8,
+        'split_seed': 0,
+        'binarized': False,
+        # Keep the training features on the training context as an NDArray
+        # (only needed for datasets that are not NDArrays already); not
+        # available for the streaming 'records' and 'images' sources
+        'resident': False,
+        # Sizes of the downsampled copies of a 'memmap' dataset (see
+        # utils/pyramid_dataset.py) to train the progressive resolutions on;
+        # None shrinks the full resolution batches instead
+        'pyramid_sizes': None,
+        'train_features': None,
+        'test_features': None,
+    },
+    'generator': None,
+    'discriminator': None,
+    'training': {
+        'batch_size': 64,
+        'n_epochs': 200,
+        'n_solo_epochs': 0,
+        'pbp_weight': 1,
+        'disc_loss_mul': 10,
+        'max_disc_loss': 999,
+        'variable_pbp_weight': 'constant',
+        'pbp_weight_decay': 1,
+        # Compile the networks into static graphs with preallocated memory
+        'hybridize': True,
+        # 'float32', or 'bfloat16' (CPU) / 'float16' (GPU) mixed precision
+        'precision': 'float32',
+        # Split every batch into micro-batches of at most this many images
+        # whose gradients are added up before the single update of the batch;
+        # None trains on whole batches
+        'micro_batch_size': None,
+    },
+    'optimizer': {
+        'name': 'adam',
+        'learning_rate': 0.001,
+    },
+    'output': {
+        # results_dir must end with a slash /
+        'results_dir': './results/',
+        'parameters_path': None,
+        'disc_parameters_path': None,
+        'n_validations': 10,
+        # Save the test images next to their reconstructions (not in gan mode)
+        'save_test_images': True,
+        # Print the running losses every report_interval batches; reading
+        # them waits for the device, so 0 only reads them at epoch end
+        'report_interval': 0,
+    },
+    'pipeline': {
+        'num_workers': 0,
+        'n_prefetch': 2,
+        'augmenter': None,
+        'resolution_schedule': None,
+        'pyramid_features': None,
+        # A LossImportanceSampler, or a dict of its keyword arguments to
+        # build one for the training rows
+        'importance_sampler': None,
+        'subset_indices_path': None,
+    },
+}
+
+MODES = ('vae', 'vae_gan', 'gan')
+PRECISIONS = ('float32', 'bfloat16', 'float16')
+
+
+def merge_config(config):
+    # Return a complete config: every section of config merged over the
+    # defaults. Networks, datasets and other objects are not copied
+    merged = {}
+    for key, default in DEFAULT_CONFIG.items():
+        value = config.get(key, default)
+        if isinstance(default, dict):
+            section = dict(default)
+            section.update(value or {})
+            value = section
+        merged[key] = value
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError('Unknown config entries: {}'.format(sorted(unknown)))
+    if merged['mode'] not in MODES:
+        raise ValueError('mode must be one of {}, got {}'.format(MODES, merged['mode']))
+    if merged['training']['precision'] not in PRECISIONS:
+        raise ValueError('precision must be one of {}, got {}'.format(PRECISIONS,
+                                                                      merged['training']['precision']))
+    return merged
+
+
+def build_network(spec, n_channels, width, height):
+    # Instantiate a network from its spec; image shape arguments that the
+    # spec leaves out are taken from the training images
+    if spec is None or isinstance(spec, gluon.Block):
+        return spec
+    kwargs = dict(spec)
+    network_class = kwargs.pop('class')
+    shape_kwargs = {'n_channels': n_channels,
+                    'n_out_channels': n_channels,
+                    'out_width': width,
+                    'out_height': height}
+    parameters = inspect.signature(network_class.__init__).parameters
+    for name, value in shape_kwargs.items():
+        if name in parameters and name not in kwargs:
+            kwargs[name] = value
+    return network_class(**kwargs)
+
+
+DATASET_SOURCES = ('anime', 'memmap', 'records', 'images', 'mnist')
+# Sources that read (and decode) every sample from disk when it is requested
+STREAMING_SOURCES = ('records', 'images')
+
+
+def open_dataset(source, path):
+    # Open the whole dataset of a file source
+    if source == 'anime':
+        # Attach to the copy of the dataset published in shared memory by a
+        # parallel sweep (see utils/shared_dataset.py) if there is one
+        return attach_or_load(path)
+    if source == 'memmap':
+        return MemmapImageDataset(path)
+    if source == 'records':
+        return RecordDataset(path)
+    return CompressedImageDataset(path)
+
+
+def load_dataset(dataset, ctx):
+    # Return the training and test features a dataset section describes,
+    # and the training features of its pyramid levels keyed by their size
+    # (None without pyramid_sizes)
+    if dataset['train_features'] is not None:
+        return dataset['train_features'], dataset['test_features'], None
+    if dataset['source'] not in DATASET_SOURCES:
+        raise ValueError('Unknown dataset source {}; the sources are {}'.format(dataset['source'],
+                                                                               DATASET_SOURCES))
+    if dataset['resident'] and dataset['source'] in STREAMING_SOURCES:
+        raise ValueError('The {} source streams its samples from disk and cannot be kept '
+                         'resident'.format(dataset['source']))
+    if dataset['pyramid_sizes'] is not None and dataset['source'] != 'memmap':
+        raise ValueError('Pyramid levels are only written for memmap datasets, '
+                         'not for the {} source'.format(dataset['source']))
+    print('[STATE]: Loading data onto context')
+    pyramid_features = None
+    if dataset['source'] == 'mnist':
+        # MNIST is read from the local cache (see utils/mnist_cache.py)
+        train_features, _ = load_mnist('train', binarized=dataset['binarized'])
+        test_features, _ = load_mnist('test', binarized=dataset['binarized'])
+    else:
+        # The split is a seeded permutation of the indices that is saved next
+        # to the dataset, so every run uses the same split
+        split_path = dataset['path'].rstrip('/')
+        train_features, test_features = train_test_split(open_dataset(dataset['source'], dataset['path']),
+                                                         split_path,
+                                                         train_fraction=dataset['train_fraction'],
+                                                         seed=dataset['split_seed'])
+        if dataset['pyramid_sizes'] is not None:
+            # The rows of every level line up with the full dataset, so the
+            # same permutation splits them
+            pyramid_features = {size: train_test_split(level,
+                                                       split_path,
+                                                       train_fraction=dataset['train_fraction'],
+                                                       seed=dataset['split_seed'])[0]
+                                for size, level in open_pyramid(dataset['path'], dataset['pyramid_sizes']).items()}
+    if dataset['resident']:
+        # Keep the training set resident on ctx; batches are then gathered
+        # with a single nd.take. Bit-packed images stay packed and are
+        # unpacked a batch at a time
+        if hasattr(train_features, 'to_resident'):
+            train_features = train_features.to_resident(ctx=ctx)
+        else:
+            train_features = train_features.to_ndarray(ctx=ctx)
+    return train_features, test_features, pyramid_features
+
+
+def open_writer(results_dir, filename):
+    # Open a report file in the results directory, or in the main directory
+    # if the results directory is not valid
+    try:
+        writer = open(results_dir + filename, 'w')
+        print('[STATE]: Writing {} to {}'.format(filename, results_dir + filename))
+    except:
+        print('[ERROR]: test results directory not valid, writing {} to main directory'.format(filename))
+        writer = open('./' + filename, 'w')
+    return writer
+
+
+def save_parameters(network, parameters_path, fallback_path):
+    # Save model parameters; if parameters_path is not valid, save them to
+    # the main directory
+    try:
+        network.save_parameters(parameters_path)
+    except:
+        print('[ERROR]: parameters path is not valid; parameters will be saved to ' + fallback_path)
+        network.save_parameters(fallback_path)
+
+
+def print_data_wait(wait_time, time_consumed):
+    # Report how much of an epoch was spent waiting on the input pipeline
+    print('[STATE]: Waited {:.2f} seconds ({:.1f}% of the epoch) for data'.format(wait_time,
+                                                                          100 * wait_time / max(time_consumed, 1e-10)))
+
+
+def print_augmentation_cost(augmenter, time_consumed):
+    # Report the mean augmentation time per batch and its share of the epoch;
+    # it is only measured when the augmenter profiles
+    if augmenter is not None and augmenter.profile:
+        print('[STATE]: Augmentation took {:.2f} ms per batch ({:.1f}% of the epoch)'.format(
+            1000 * augmenter.mean_batch_time(),
+            100 * augmenter.total_time / max(time_consumed, 1e-10)))
+
+
+def unpack_batch(batch):
+    # Batches drawn by an importance sampler come with their row indices and
+    # importance weights; plain batches have neither
+    if isinstance(batch, tuple):
+        return batch
+    return batch, None, None
+
+
+def concat_losses(losses):
+    # Join the per-sample losses of the micro-batches of a batch
+    if len(losses) == 1:
+        return losses[0]
+    return nd.concat(*losses, dim=0)
+
+
+def importance_weighted(losses, weights):
+    # Weight per-sample losses by their importance weights, if any
+    if weights is None:
+        return losses
+    return losses * weights
+
+
+@contextmanager
+def frozen(network):
+    # Compute no gradients for the parameters of network inside the block,
+    # e.g. for the discriminator while the generator is updated through it;
+    # gradients still flow through network to its inputs. Setting grad_req
+    # would free the gradient buffers and allocate new ones when it is set
+    # back, so instead the parameters are only marked for autograd again,
+    # keeping their gradient buffers and their contents
+    params = [param for param in network.collect_params().values() if param.grad_req != 'null']
+    data = [array for param in params for array in param.list_data()]
+    grads = [array for param in params for array in param.list_grad()]
+    grad_reqs = [param.grad_req for param in params for _ in param.list_data()]
+    autograd.mark_variables(data, grads, 'null')
+    try:
+        yield
+    finally:
+        autograd.mark_variables(data, grads, grad_reqs)
+
+
+def resolution_at_epoch(resolution_schedule, epoch):
+    # Return the square resolution that an epoch trains at in progressive
+    # training, or None for full resolution
+    if resolution_schedule is not None:
+        first_epoch = 0
+        for size, n_epochs in resolution_schedule:
+            if epoch < first_epoch + n_epochs:
+                return size
+            first_epoch += n_epochs
+    return None
+
+
+class TrainingEngine(object):
+
+    def __init__(self, config):
+        self.config = merge_config(config)
+        self.mode = self.config['mode']
+        self.training = self.config['training']
+        self.output = self.config['output']
+        self.pipeline = self.config['pipeline']
+        self.ctx = self.config['ctx'] or d2l.try_gpu()
+        self.augmenter = self.pipeline['augmenter']
+        self.resolution_schedule = self.pipeline['resolution_schedule']
+        self.disc_loss_func = gloss.SigmoidBinaryCrossEntropyLoss(from_sigmoid=False)
+        # Labels and latent noise are reused from batch to batch
+        self.buffers = BufferPool(self.ctx)
+        # Batches may be run as micro-batches whose gradients add up
+        self.micro_batching = self.training['micro_batch_size'] is not None
+        if self.micro_batching and self.training['micro_batch_size'] < 1:
+            raise ValueError('micro_batch_size must be at least 1, got {}'.format(self.training['micro_batch_size']))
+
+        # Mixed precision: AMP runs the convolution and dense layers in the
+        # reduced precision and keeps the parameters, which the trainers
+        # update, in float32; the models reduce their losses in float32.
+        # bfloat16 has the exponent range of float32 and needs no loss
+        # scaling, float16 gets dynamic loss scaling. MXNet only has bfloat16
+        # kernels on CPU and float16 kernels on GPU, and its bfloat16 backward
+        # of Conv2DTranspose fails, so the decoders' Deconvolutions stay in
+        # float32 under bfloat16
+        self.precision = self.training['precision']
+        if self.precision != 'float32':
+            device_type = 'cpu' if self.precision == 'bfloat16' else 'gpu'
+            if self.ctx.device_type != device_type:
+                raise ValueError('{} precision needs a {} context, got {}'.format(self.precision,
+                                                                                  device_type,
+                                                                                  self.ctx))
+            print('[STATE]: Training with {} mixed precision'.format(self.precision))
+            if self.precision == 'bfloat16':
+                amp.init(target_dtype=self.precision, fp32_ops=['Deconvolution'])
+            else:
+                amp.init(target_dtype=self.precision)
+
+        if self.config['seed'] is not None:
+            print('[STATE]: Random seed chosen is {}'.format(self.config['seed']))
+            mx.random.seed(self.config['seed'])
+
+        self.train_features, self.test_features, self.pyramid_features = load_dataset(self.config['dataset'],
+                                                                                      self.ctx)
+        _, self.n_channels, self.width, self.height = self.train_features.shape
+        self.generator = build_network(self.config['generator'], self.n_channels, self.width, self.height)
+        self.disc_net = build_network(self.config['discriminator'], self.n_channels, self.width, self.height)
+        if self.generator is None:
+            raise ValueError('The config has no generator')
+        if self.mode != 'vae' and self.disc_net is None:
+            raise ValueError('Mode {} needs a discriminator'.format(self.mode))
+        if self.resolution_schedule is not None:
+            # Only the generator grows; a discriminator that ends in a Dense
+            # layer would have to see the small images scaled up to full
+            # resolution, which saves nothing
+            for size, _ in self.resolution_schedule:
+                if size not in getattr(self.generator, 'progressive_sizes', []):
+                    raise ValueError('The generator has no output head for the scheduled size {}'.format(size))
+            if self.disc_net is not None and not getattr(self.disc_net, 'resolution_agnostic', False):
+                raise ValueError('Progressive-resolution training needs a resolution agnostic discriminator '
+                                 'such as the ResNet')
+
+    #############################################################################
+    ## MODEL INITIALIZATION AND TRAINERS
+    #############################################################################
+    def _infer_shapes(self, network):
+        # Parameters are initialized lazily from the first input a layer sees.
+        # Run network once on a dummy input at every resolution it can work
+        # at, so that the decoder blocks and output heads that only run at
+        # some resolutions are initialized before a graph that leaves them
+        # out is built
+        sizes = [None]
+        if network is self.generator:
+            sizes += getattr(network, 'progressive_sizes', [])
+        for size in sizes:
+            if len(sizes) > 1:
+                network.out_size = size
+            if network is self.generator and self.mode == 'gan':
+                network(nd.zeros((1, network.n_latent, 1, 1), ctx=self.ctx))
+            else:
+                network(nd.zeros((1, self.n_channels, size or self.width, size or self.height), ctx=self.ctx))
+        if len(sizes) > 1:
+            network.out_size = None
+
+    def _initialize(self, network):
+        network.collect_params().initialize(mx.init.Xavier(),
+                                            force_reinit=True,
+                                            ctx=self.ctx)
+        self._infer_shapes(network)
+        if self.micro_batching:
+            # The gradients of the micro-batches of a batch add up;
+            # _zero_grad clears them before every batch
+            for param in network.collect_params().values():
+                if param.grad_req != 'null':
+                    param.grad_req = 'add'
+        if self.training['hybridize']:
+            # Every batch shape (the last batch of an epoch may be smaller)
+            # and every change of pbp_weight or out_size builds its own graph
+            network.hybridize(static_alloc=True, static_shape=True)
+        trainer = gluon.Trainer(network.collect_params(),
+                                self.config['optimizer']['name'],
+                                {'learning_rate': self.config['optimizer']['learning_rate']})
+        if self.precision == 'float16':
+            amp.init_trainer(trainer)
+        return trainer
+
+    def _build_trainers(self):
+        print('[STATE]: Initializing model parameters and constructing Gluon trainers')
+        if self.mode != 'gan':
+            # Set the pbp weight to the desired value
+            self.generator.pbp_weight = self.training['pbp_weight']
+        self.gen_trainer = self._initialize(self.generator)
+        self.disc_trainer = None
+        if self.disc_net is not None:
+            self.disc_trainer = self._initialize(self.disc_net)
+
+    #############################################################################
+    ## Output file writer initialization
+    #############################################################################
+    def _open_reports(self):
+        results_dir = self.output['results_dir']
+        # Open a file to write to for training statistics; the CSV needs to
+        # open with a header that is the column names
+        self.csv_writer = open_writer(results_dir, 'training_statistics.csv')
+        if self.mode == 'vae':
+            self.csv_writer.write('epoch,vae_loss,time_consumed\n')
+        elif self.mode == 'vae_gan':
+            self.csv_writer.write('epoch,vae_loss,disc_loss,time_consumed\n')
+        else:
+            self.csv_writer.write('epoch,gen_loss,disc_loss,time_consumed\n')
+
+        # Open a file to write README.md for displaying validation images, and
+        # write a few lines on it to indicate the hyper parameters
+        self.readme_writer = open_writer(results_dir, 'README.md')
+        readme_writer = self.readme_writer
+        readme_writer.write('generator:{} \n\n'.format(type(self.generator).__name__))
+        for name in ('n_latent', 'n_base_channels', 'n_hlayers', 'n_hnodes'):
+            if hasattr(self.generator, name):
+                readme_writer.write('{}:{} \n\n'.format(name, getattr(self.generator, name)))
+        if self.disc_net is not None:
+            readme_writer.write('discriminator:{} \n\n'.format(type(self.disc_net).__name__))
+        if self.mode != 'gan':
+            if self.training['variable_pbp_weight'] == 'decay':
+                readme_writer.write('pixel-by-pixel loss weight initially {} and decay by {} every 25 combo epochs \n\n'.format(
+                    self.generator.pbp_weight, self.training['pbp_weight_decay']))
+            else:
+                readme_writer.write('pixel-by-pixel loss weight:{} \n\n'.format(self.generator.pbp_weight))
+        if self.mode == 'vae_gan':
+            readme_writer.write('n_solo_epochs:{} \n\n'.format(self.training['n_solo_epochs']))
+            readme_writer.write('n_combo_epochs:{} \n\n'.format(self.training['n_epochs'] -
+                                                               self.training['n_solo_epochs']))
+            readme_writer.write('max_disc_loss :{} \n\n'.format(self.training['max_disc_loss']))
+            readme_writer.write('disc_loss_mul:{} \n\n'.format(self.training['disc_loss_mul']))
+        else:
+            readme_writer.write('n_epochs:{} \n\n'.format(self.training['n_epochs']))
+        readme_writer.write('learning rate:{} \n\n'.format(self.config['optimizer']['learning_rate']))
+        if self.micro_batching:
+            readme_writer.write('batch_size:{} in micro-batches of {} \n\n'.format(self.training['batch_size'],
+                                                                               self.training['micro_batch_size']))
+        if self.resolution_schedule is not None:
+            readme_writer.write('resolution schedule (size, n_epochs):{} \n\n'.format(self.resolution_schedule))
+
+    #############################################################################
+    ## Data iterator
+    #############################################################################
+    def _make_train_iter(self, features):
+        # train_features is either an NDArray or a Dataset (e.g.
+        # memmap_dataset.MemmapImageDataset) that provides its own batchify_fn
+        # for turning samples into a float batch. Features held whole in an
+        # NDArray (or a split of one) are batched with a single nd.take per
+        # batch instead of a DataLoader
+        resident = resident_arrays(features)
+        if self.importance_sampler is not None:
+            batches = ImportanceBatchIterator(features, self.importance_sampler)
+        elif resident is not None:
+            batches = GatherIterator(resident[0], self.training['batch_size'], shuffle=True, indices=resident[1])
+        else:
+            batches = gdata.DataLoader(features,
+                                       self.training['batch_size'],
+                                       shuffle=True,
+                                       last_batch='keep',
+                                       batchify_fn=getattr(features, 'batchify_fn', None),
+                                       num_workers=self.pipeline['num_workers'])
+        # Prepare the next batches in the background; batches come out of the
+        # prefetching iterator already on ctx
+        return PrefetchIterator(batches, self.ctx, self.pipeline['n_prefetch'])
+
+    def _build_iterators(self):
+        train_features = self.train_features
+        # Pyramid levels are passed in or loaded with the dataset
+        pyramid_features = self.pipeline['pyramid_features'] or self.pyramid_features
+        # Restrict training to the saved subset of rows
+        subset_indices_path = self.pipeline['subset_indices_path']
+        if subset_indices_path is not None:
+            subset_indices = np.load(subset_indices_path)
+            train_features = SubsetDataset(train_features, subset_indices)
+            if pyramid_features is not None:
+                pyramid_features = {size: SubsetDataset(features, subset_indices)
+                                    for size, features in pyramid_features.items()}
+            print('[STATE]: Training on the {} rows in {}'.format(len(subset_indices), subset_indices_path))
+            self.readme_writer.write('training subset:{} \n\n'.format(subset_indices_path))
+
+        # Importance sampling weights the per-sample VAE loss, which a GAN does
+        # not have
+        self.importance_sampler = self.pipeline['importance_sampler']
+        if self.importance_sampler is not None and self.mode == 'gan':
+            raise ValueError('Importance sampling needs a VAE loss; it is not available in gan mode')
+        if isinstance(self.importance_sampler, dict):
+            self.importance_sampler = LossImportanceSampler(len(train_features),
+                                                            self.training['batch_size'],
+                                                            **self.importance_sampler)
+
+        self.train_iter = self._make_train_iter(train_features)
+        # Iterators over the smaller copies of the training features
+        self.pyramid_iters = {}
+        if pyramid_features is not None:
+            self.pyramid_iters = {size: self._make_train_iter(features)
+                                  for size, features in pyramid_features.items()}
+        print('[STATE]: {} training samples loaded into iterator'.format(len(train_features)))
+
+    #############################################################################
+    ## Progressive resolution
+    #############################################################################
+    def _set_resolution(self, epoch):
+        # Grow the generator to the resolution of this epoch; return the
+        # resolution (None for full) and the iterator to train with
+        out_size = resolution_at_epoch(self.resolution_schedule, epoch)
+        if self.resolution_schedule is not None and out_size != self.generator.out_size:
+            print('[STATE]: Training at {}x{} from epoch {}'.format(out_size or self.width,
+                                                                  out_size or self.height,
+                                                                  epoch))
+            self.generator.out_size = out_size
+        return out_size, self.pyramid_iters.get(out_size, self.train_iter)
+
+    #############################################################################
+    ## Training steps
+    #############################################################################
+    def _backward(self, loss, trainer):
+        # Backpropagate loss for the update of trainer, scaled in float16
+        if self.precision == 'float16':
+            with amp.scale_loss(loss, trainer) as scaled_loss:
+                autograd.backward(scaled_loss)
+        else:
+            loss.backward()
+
+    def _disc_loss(self, logit_preds, labels):
+        # The discriminator loss is computed in float32 whatever precision
+        # the discriminator's layers run in
+        if self.precision != 'float32':
+            logit_preds = nd.amp_cast(logit_preds, dtype='float32')
+        return self.disc_loss_func(logit_preds, labels)
+
+    def _generate_fakes(self, batch_features):
+        # Generated counterparts of a batch: reconstructions for a VAE, decoded
+        # latent noise for a GAN
+        if self.mode == 'gan':
+            latent_z = self.buffers.normal('latent_z', (batch_features.shape[0], self.generator.n_latent, 1, 1))
+            return self.generator(latent_z)
+        return self.generator.generate(batch_features)
+
+    def _labels(self, batch_size):
+        # 1s and 0s for distinguishing genuine images from generated images
+        return (self.buffers.constant('genuine_labels', (batch_size,), 1),
+                self.buffers.constant('generated_labels', (batch_size,), 0))
+
+    def _micro_batches(self, *arrays):
+        # Split the arrays of a batch (e.g. the images and their importance
+        # weights; None stays None) into micro-batches of at most
+        # micro_batch_size rows. Without micro-batching the whole batch is the
+        # only micro-batch
+        batch_size = arrays[0].shape[0]
+        micro_batch_size = self.training['micro_batch_size'] or batch_size
+        return [tuple(None if array is None else array[start:start + micro_batch_size] for array in arrays)
+                for start in range(0, batch_size, micro_batch_size)]
+
+    def _zero_grad(self, network):
+        # Gradients of micro-batches add up, so they are cleared before the
+        # first micro-batch of a batch
+        if self.micro_batching:
+            network.collect_params().zero_grad()
+
+    def _step(self, trainer, batch_size):
+        # Update with the gradients of a whole batch. In progressive training
+        # the layers that do not run at the current resolution get no
+        # gradients and are left as they are
+        trainer.step(batch_size, ignore_stale_grad=self.resolution_schedule is not None)
+
+    def _solo_step(self, batch_features, batch_weights):
+        # Update the VAE on its own loss; return the batch loss and the
+        # unweighted per-sample losses
+        losses = []
+        sample_losses = []
+        self._zero_grad(self.generator)
+        for features, weights in self._micro_batches(batch_features, batch_weights):
+            with autograd.record():
+                micro_sample_losses, _ = self.generator(features)
+                loss = importance_weighted(micro_sample_losses, weights)
+                self._backward(loss, self.gen_trainer)
+            losses.append(loss)
+            sample_losses.append(micro_sample_losses)
+        self._step(self.gen_trainer, batch_features.shape[0])
+        return concat_losses(losses), concat_losses(sample_losses)
+
+    def _disc_step(self, batch_features, generated_features=None):
+        # Update the discriminator on genuine and generated images; the
+        # generated images are made here unless they are passed in, and must
+        # not be attached to the generator's graph
+        disc_losses = []
+        self._zero_grad(self.disc_net)
+        for features, fakes in self._micro_batches(batch_features, generated_features):
+            genuine_labels, generated_labels = self._labels(features.shape[0])
+            if fakes is None:
+                # The generator is not updated here, so its forward pass is run
+                # in training mode without being recorded
+                with autograd.train_mode():
+                    fakes = self._generate_fakes(features)
+            with autograd.record():
+                genuine_logit_preds = self.disc_net(features)
+                genuine_loss = self._disc_loss(genuine_logit_preds, genuine_labels)
+                generated_logit_preds = self.disc_net(fakes)
+                generated_loss = self._disc_loss(generated_logit_preds, generated_labels)
+                # Total loss is loss with genuine and with generated images
+                disc_loss = genuine_loss + generated_loss
+                self._backward(disc_loss, self.disc_trainer)
+            disc_losses.append(disc_loss)
+        self._step(self.disc_trainer, batch_features.shape[0])
+        return concat_losses(disc_losses)
+
+    def _gen_step(self, batch_features, batch_weights, use_disc_loss):
+        # Update the generator against the discriminator; a VAE adds its own
+        # loss, and the discriminator loss only counts while use_disc_loss is 1.
+        # Return the batch loss and the unweighted per-sample VAE losses. The
+        # discriminator is frozen, so no gradients are computed for it
+        gen_losses = []
+        sample_vae_losses = []
+        self._zero_grad(self.generator)
+        with frozen(self.disc_net):
+            for features, weights in self._micro_batches(batch_features, batch_weights):
+                genuine_labels, _ = self._labels(features.shape[0])
+                with autograd.record():
+                    generated_logit_preds = self.disc_net(self._generate_fakes(features))
+                    batch_disc_loss = self._disc_loss(generated_logit_preds, genuine_labels)
+                    if self.mode == 'gan':
+                        gen_loss = batch_disc_loss
+                    else:
+                        micro_sample_losses, _ = self.generator(features)
+                        gen_loss = (importance_weighted(micro_sample_losses, weights) +
+                                    batch_disc_loss * self.training['disc_loss_mul'] * use_disc_loss)
+                        sample_vae_losses.append(micro_sample_losses)
+                    self._backward(gen_loss, self.gen_trainer)
+                gen_losses.append(gen_loss)
+        self._step(self.gen_trainer, batch_features.shape[0])
+        return concat_losses(gen_losses), concat_losses(sample_vae_losses) if sample_vae_losses else None
+
+    def _combo_step(self, batch_features, batch_weights, use_disc_loss):
+        # Update the discriminator and then the VAE from a single pass of the
+        # VAE: its reconstructions are the generated images of both updates.
+        # The discriminator update sees them detached, which keeps the VAE
+        # part of the graph alive for the VAE update. Return the discriminator
+        # loss, the VAE batch loss and the unweighted per-sample VAE losses
+        with autograd.record():
+            sample_vae_losses, generated_features = self.generator(batch_features)
+        disc_loss = self._disc_step(batch_features, generated_features.detach())
+        genuine_labels, _ = self._labels(batch_features.shape[0])
+        self._zero_grad(self.generator)
+        with frozen(self.disc_net), autograd.record():
+            # The discriminator judges the reconstructions after its update,
+            # as when they were generated again
+            generated_logit_preds = self.disc_net(generated_features)
+            batch_disc_loss = self._disc_loss(generated_logit_preds, genuine_labels)
+            gen_loss = (importance_weighted(sample_vae_losses, batch_weights) +
+                        batch_disc_loss * self.training['disc_loss_mul'] * use_disc_loss)
+            self._backward(gen_loss, self.gen_trainer)
+        self._step(self.gen_trainer, batch_features.shape[0])
+        return disc_loss, gen_loss, sample_vae_losses
+
+    def _train_epoch(self, epoch, solo, use_disc_loss):
+        # Train one epoch; return the mean generator loss, the mean
+        # discriminator loss (None for solo epochs) and the epoch iterator
+        out_size, epoch_iter = self._set_resolution(epoch)
+        epoch_iter.reset_wait_time()
+        if self.augmenter is not None:
+            self.augmenter.reset_timer()
+
+        # The average loss within each batch stays on the device until the
+        # epoch (or a report interval) is over
+        gen_batch_losses = LossAccumulator()
+        disc_batch_losses = LossAccumulator()
+        report_interval = self.output['report_interval']
+        for batch in epoch_iter:
+            batch_features, batch_indices, batch_weights = unpack_batch(batch)
+            if out_size is not None:
+                batch_features = resize_img_batch(batch_features, out_size, out_size)
+            if self.augmenter is not None:
+                batch_features = self.augmenter(batch_features)
+
+            if solo:
+                gen_loss, sample_losses = self._solo_step(batch_features, batch_weights)
+            else:
+                # The single pass combo step would keep the VAE graphs of all
+                # micro-batches alive at once, so micro-batched VAE-GANs run the
+                # VAE again for the VAE update
+                if self.mode == 'vae_gan' and not self.micro_batching:
+                    disc_loss, gen_loss, sample_losses = self._combo_step(batch_features, batch_weights,
+                                                                          use_disc_loss)
+                else:
+                    disc_loss = self._disc_step(batch_features)
+                    gen_loss, sample_losses = self._gen_step(batch_features, batch_weights, use_disc_loss)
+                disc_batch_losses.add(disc_loss)
+            gen_batch_losses.add(gen_loss)
+            if self.importance_sampler is not None:
+                self.importance_sampler.update(batch_indices.asnumpy(), sample_losses.asnumpy())
+            if report_interval and len(gen_batch_losses) % report_interval == 0:
+                report = '[STATE]: Epoch{}, batch {}, running loss {:.5f}'.format(epoch,
+                                                                           len(gen_batch_losses),
+                                                                           gen_batch_losses.mean())
+                if not solo:
+                    report += ', running discriminator loss {:.10f}'.format(disc_batch_losses.mean())
+                print(report)
+
+        return gen_batch_losses.mean(), disc_batch_losses.mean(), epoch_iter
+
+    def _report_epoch(self, epoch, gen_loss, disc_loss, time_consumed, epoch_iter):
+        # Generate the README line and the csv line, and write them; the solo
+        # epochs of a VAE-GAN are left out of the CSV
+        if disc_loss is None:
+            report = 'Epoch{}, Training loss {:.10f}, Time used {:.2f}'.format(epoch, gen_loss, time_consumed)
+            if self.mode == 'vae':
+                self.csv_writer.write('{},{:.10f},{:.2f}\n'.format(epoch, gen_loss, time_consumed))
+        else:
+            gen_name = 'VAE' if self.mode == 'vae_gan' else type(self.generator).__name__
+            report = 'Epoch{}, {} Training loss {:.5f}, {} Training loss {:.10f}, Time used {:.2f}'.format(
+                epoch, gen_name, gen_loss, type(self.disc_net).__name__, disc_loss, time_consumed)
+            self.csv_writer.write('{},{:.10f},{:.10f},{:.2f}\n'.format(epoch, gen_loss, disc_loss, time_consumed))
+        self.readme_writer.write(report + '\n\n')
+        print('[STATE]: ' + report)
+        print_data_wait(epoch_iter.wait_time, time_consumed)
+        print_augmentation_cost(self.augmenter, time_consumed)
+
+    def _train(self):
+        n_epochs = self.training['n_epochs']
+        n_solo_epochs = self.training['n_solo_epochs'] if self.mode == 'vae_gan' else 0
+        if self.mode == 'vae':
+            n_solo_epochs = n_epochs
+        print('[STATE]: {} solo epochs and {} combo epochs are to be trained'.format(n_solo_epochs,
+                                                                                     n_epochs - n_solo_epochs))
+        print('[STATE]: Training started')
+
+        # Solo epochs of a VAE-GAN train with a PBP weight of 1; keep a copy of
+        # the specified PBP weight for the combo epochs
+        specified_pbp_weight = getattr(self.generator, 'pbp_weight', None)
+        if self.mode == 'vae_gan':
+            self.generator.pbp_weight = 1
+        # use_disc_loss is 0 while the discriminator loss of the last epoch is
+        # larger than max_disc_loss (discriminator is bad, don't follow it);
+        # the discriminator keeps training either way
+        use_disc_loss = 1
+        for epoch in range(n_epochs):
+            solo = epoch < n_solo_epochs
+            if self.mode == 'vae_gan' and epoch == n_solo_epochs:
+                self.generator.pbp_weight = specified_pbp_weight
+
+            start_time = time.time()
+            gen_loss, disc_loss, epoch_iter = self._train_epoch(epoch, solo, use_disc_loss)
+            time_consumed = time.time() - start_time
+
+            if not solo and self.mode == 'vae_gan':
+                # If variable_pbp_weight is set to decay, then decay the pbp
+                # weight every 25 epochs
+                if self.training['variable_pbp_weight'] == 'decay' and (1+epoch) % 25 == 0:
+                    self.generator.pbp_weight = self.generator.pbp_weight * self.training['pbp_weight_decay']
+                    print('VAE PBP weight adjusted to {:.10f}'.format(self.generator.pbp_weight))
+                use_disc_loss = 1 if disc_loss <= self.training['max_disc_loss'] else 0
+            self._report_epoch(epoch, gen_loss, disc_loss, time_consumed, epoch_iter)
+        if self.mode == 'vae_gan' and n_solo_epochs == n_epochs:
+            self.generator.pbp_weight = specified_pbp_weight
+
+    #############################################################################
+    ## Validation
+    #############################################################################
+    def _save_image(self, img_array, filename):
+        # Show the image, save it. If the results directory is not valid, save
+        # it to main directory. Images are stored as their (width, height,
+        # n_channels) pixel arrays reshaped to (n_channels, width, height)
+        if self.n_channels == 1:
+            img_array = img_array.reshape((self.width, self.height))
+        else:
+            img_array = img_array.reshape((self.width, self.height, self.n_channels))
+        plt.imshow(img_array)
+        try:
+            plt.savefig(self.output['results_dir'] + filename)
+            print('[STATE]: ' + self.output['results_dir'] + filename + ' saved')
+        except:
+            print('[ERROR]: test results directory not valid, saving images to main directory')
+            plt.savefig('./' + filename)
+        plt.close()
+
+    def _validate(self):
+        # Validation images are generated at full resolution
+        if self.resolution_schedule is not None:
+            self.generator.out_size = None
+        n_validations = self.output['n_validations']
+        if self.mode == 'gan':
+            latent_z = nd.random_normal(0, 1, shape=(n_validations, self.generator.n_latent, 1, 1), ctx=self.ctx)
+            img_arrays = self.generator(latent_z).asnumpy()
+        else:
+            img_arrays = self.generator.generate(self.test_features[0:n_validations].as_in_context(self.ctx)).asnumpy()
+        for i in range(n_validations):
+            # Write a line in the README report displaying the generated images
+            self.readme_writer.write('!['+str(i)+'](./'+str(i)+'.png)')
+            self._save_image(img_arrays[i], str(i) + '.png')
+            if self.mode != 'gan' and self.output['save_test_images']:
+                self.readme_writer.write('!['+str(i)+'](./test_'+str(i)+'.png)')
+                self._save_image(self.test_features[i:i+1].asnumpy(), 'test_' + str(i) + '.png')
+
+    def run(self):
+        self._build_trainers()
+        self._open_reports()
+        self._build_iterators()
+        self._train()
+        # Close the CSV writer because there is nothing left to write
+        self.csv_writer.close()
+        save_parameters(self.generator, self.output['parameters_path'], './recent_model.params')
+        if self.output['disc_parameters_path'] is not None and self.disc_net is not None:
+            save_parameters(self.disc_net, self.output['disc_parameters_path'], './recent_disc_model.params')
+        self._validate()
+        self.readme_writer.close()
+
+
+def train(config):
+    # Train the experiment that config describes; return the engine, whose
+    # generator and disc_net hold the trained networks
+    engine = TrainingEngine(config)
+    engine.run()
+    return engine
@@ -0,0 +1,122 @@
+import time
+from mxnet import nd
+
+# Data augmentation applied to whole batches with NDArray operations, so it
+# runs on the training context right before the batch reaches the model
+# instead of image by image in the DataLoader.
+#
+# Every image gets its own random horizontal flip and its own random shift
+# of up to crop_padding pixels; a shift of a zero padded image is the same
+# as a random crop with padding. Both are folded into a single affine
+# resampling of the batch. Color jitter scales brightness, contrast and
+# saturation by per-image random factors.
+#
+# Note on layout: the datasets store every image as its (width, height,
+# n_channels) pixel array reshaped (not transposed) to (n_channels, width,
+# height). The augmenter therefore views the batch in its real pixel layout
+# before flipping and cropping it, and returns it in the stored layout.
+#
+# Augmentation is queued asynchronously like any other NDArray work. With
+# profile=True the augmenter waits for its input and its output on every
+# batch to measure its cost, which stalls the training loop; use it only to
+# find out what the augmentation costs.
+
+# Weights for turning RGB pixels into gray levels
+GRAY_WEIGHTS = [0.299, 0.587, 0.114]
+
+
+class BatchAugmenter(object):
+
+    def __init__(self, flip_prob=0.5,
+                 crop_padding=4,
+                 brightness=0.1,
+                 contrast=0.1,
+                 saturation=0.1,
+                 profile=False):
+        self.flip_prob = flip_prob
+        self.crop_padding = crop_padding
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.profile = profile
+
+        # Time spent augmenting when profiling, for reporting the cost per
+        # batch
+        self.total_time = 0.
+        self.n_batches = 0
+
+    def reset_timer(self):
+        self.total_time = 0.
+        self.n_batches = 0
+
+    def mean_batch_time(self):
+        return self.total_time / max(self.n_batches, 1)
+
+    def _random_factors(self, strength, batch_size, ctx):
+        # One factor per image, uniform in [1 - strength, 1 + strength]
+        return nd.random.uniform(1 - strength, 1 + strength, shape=(batch_size, 1, 1, 1), ctx=ctx)
+
+    def _flip_and_crop(self, images):
+        # images.shape = (batch_size, n_channels, n_rows, n_cols)
+        batch_size, _, n_rows, n_cols = images.shape
+        ctx = images.context
+
+        # Build one affine transform per image: x scaled by -1 flips the image
+        # horizontally, and the translations are whole pixels in the
+        # normalized [-1, 1] coordinates of the sampler, so the resampling is
+        # exact and pixels shifted in from outside the image are 0
+        flips = nd.random.uniform(0, 1, shape=(batch_size,), ctx=ctx) < self.flip_prob
+        x_scales = 1 - 2 * flips
+        shifts = nd.random.randint(-self.crop_padding, self.crop_padding + 1,
+                                   shape=(batch_size, 2), ctx=ctx).astype('float32')
+        x_shifts = shifts[:, 0] * 2 / (n_cols - 1)
+        y_shifts = shifts[:, 1] * 2 / (n_rows - 1)
+        zeros = nd.zeros((batch_size,), ctx=ctx)
+        ones = nd.ones((batch_size,), ctx=ctx)
+        affine = nd.stack(x_scales, zeros, x_shifts, zeros, ones, y_shifts, axis=1)
+        grid = nd.GridGenerator(data=affine, transform_type='affine', target_shape=(n_rows, n_cols))
+        return nd.BilinearSampler(images, grid)
+
+    def _gray(self, images):
+        # Gray level of every pixel, of shape (batch_size, 1, n_rows, n_cols)
+        if images.shape[1] == 3:
+            return nd.sum(images * nd.array(GRAY_WEIGHTS, ctx=images.context).reshape((1, 3, 1, 1)),
+                          axis=1, keepdims=True)
+        return nd.mean(images, axis=1, keepdims=True)
+
+    def _jitter_colors(self, images):
+        batch_size, n_channels, _, _ = images.shape
+        ctx = images.context
+        if self.brightness > 0:
+            images = images * self._random_factors(self.brightness, batch_size, ctx)
+        if self.contrast > 0:
+            gray_mean = nd.mean(self._gray(images), axis=(1, 2, 3), keepdims=True)
+            images = (images - gray_mean) * self._random_factors(self.contrast, batch_size, ctx) + gray_mean
+        if self.saturation > 0 and n_channels == 3:
+            gray = self._gray(images)
+            images = (images - gray) * self._random_factors(self.saturation, batch_size, ctx) + gray
+        return nd.clip(images, 0, 1)
+
+    def __call__(self, batch):
+        # batch.shape = (batch_size, n_channels, width, height) in the stored
+        # layout; the returned batch has the same shape and layout
+        if self.profile:
+            # Let the work queued before the augmentation finish first, so
+            # that it is not counted as augmentation time
+            batch.wait_to_read()
+            start_time = time.time()
+        batch_size, n_channels, width, height = batch.shape
+
+        # View the batch in its real pixel layout
+        images = batch.reshape((batch_size, width, height, n_channels)).transpose((0, 3, 1, 2))
+        if self.flip_prob > 0 or self.crop_padding > 0:
+            images = self._flip_and_crop(images)
+        images = self._jitter_colors(images)
+        augmented = images.transpose((0, 2, 3, 1)).reshape((batch_size, n_channels, width, height))
+
+        if self.profile:
+            # Wait for the result so that the measured time is the real cost
+            augmented.wait_to_read()
+            self.total_time += time.time() - start_time
+            self.n_batches += 1
+        return augmented
@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import mxnet as mx
+from mxnet import nd
+from mxnet.gluon import data as gdata
+
+import convert_to_NDArray as converter
+from compressed_image_dataset import CompressedImageDataset
+from dataset_split import train_test_split
+from gather_iterator import GatherIterator
+from memmap_dataset import MemmapImageDataset
+from prefetch_iterator import PrefetchIterator
+from record_dataset import RecordDataset
+
+# Benchmark of the data path on its own, without any model:
+#   1. converter throughput (images/s) of every output format
+#   2. load time of every converted dataset
+#   3. iterator throughput (batches/s) of every way of batching a dataset
+# It runs against a folder of synthetic images that it generates itself,
+# so it works offline and gives comparable numbers on any machine. The
+# results are written as JSON to OUTPUT_PATH, or to the path given as the
+# first command line argument.
+#
+# Run from the main directory:
+#   python utils/benchmark_input_pipeline.py [output.json]
+
+N_IMAGES = 2048
+IMG_SIZE = 64
+BATCH_SIZE = 64
+N_WORKERS = converter.N_WORKERS
+N_EPOCHS = 2
+OUTPUT_PATH = './results/input_pipeline_benchmark.json'
+
+
+def generate_image_folder(img_dir, n_images=N_IMAGES, img_size=IMG_SIZE, seed=0):
+    # Write n_images random RGB images as PNG files; smooth noise compresses
+    # and decodes more like real images than white noise does
+    os.makedirs(img_dir, exist_ok=True)
+    random_state = np.random.RandomState(seed)
+    for i in range(n_images):
+        coarse = random_state.rand(img_size // 8, img_size // 8, 3)
+        img_array = np.kron(coarse, np.ones((8, 8, 1)))
+        img_array += 0.1 * random_state.rand(img_size, img_size, 3)
+        plt.imsave(os.path.join(img_dir, '{:06d}.png'.format(i)), np.clip(img_array, 0, 1))
+
+
+def convert_to_ndarray_sequential(img_dir, ndy_path):
+    # The original converter: decode every image in turn into one float32
+    # NDArray and save it
+    img_paths = [os.path.join(img_dir, filename) for filename in sorted(os.listdir(img_dir))]
+    first_img = converter.read_image(img_paths[0])
+    output = nd.zeros((len(img_paths),) + first_img.shape)
+    for i, img_path in enumerate(img_paths):
+        output[i] = converter.read_image(img_path)
+    nd.save(ndy_path, [output])
+    return len(img_paths)
+
+
+def time_call(function, *args):
+    start_time = time.time()
+    result = function(*args)
+    return result, time.time() - start_time
+
+
+def iterate_epochs(batches, n_epochs=N_EPOCHS):
+    # Return the number of batches per second over n_epochs; every batch is
+    # waited for so that asynchronous execution does not hide its cost
+    n_batches = 0
+    start_time = time.time()
+    for _ in range(n_epochs):
+        for batch in batches:
+            batch.wait_to_read()
+            n_batches += 1
+    return n_batches / (time.time() - start_time)
+
+
+def data_loader(features, num_workers=0):
+    return gdata.DataLoader(features,
+                            BATCH_SIZE,
+                            shuffle=True,
+                            last_batch='keep',
+                            batchify_fn=getattr(features, 'batchify_fn', None),
+                            num_workers=num_workers)
+
+
+def run_benchmark(work_dir):
+    img_dir = os.path.join(work_dir, 'images')
+    ndy_path = os.path.join(work_dir, 'images.ndy')
+    shard_dir = os.path.join(work_dir, 'shards')
+    memmap_path = os.path.join(work_dir, 'images.u8')
+    record_dir = os.path.join(work_dir, 'records')
+    ctx = mx.cpu()
+
+    print('[STATE]: Generating {} synthetic images in {}'.format(N_IMAGES, img_dir))
+    generate_image_folder(img_dir)
+
+    results = {'n_images': N_IMAGES,
+               'img_size': IMG_SIZE,
+               'batch_size': BATCH_SIZE,
+               'n_workers': N_WORKERS,
+               'n_epochs': N_EPOCHS,
+               'converter_images_per_s': {},
+               'load_time_s': {},
+               'iterator_batches_per_s': {}}
+
+    # Converter throughput
+    conversions = [('ndarray_sequential', convert_to_ndarray_sequential, (img_dir, ndy_path)),
+                   ('shards', converter.convert_to_shards, (img_dir, shard_dir, converter.SHARD_SIZE, N_WORKERS)),
+                   ('memmap', converter.convert_to_memmap, (img_dir, memmap_path, converter.SHARD_SIZE, N_WORKERS)),
+                   ('records', converter.convert_to_records, (img_dir, record_dir, converter.SHARD_SIZE, None,
+                                                              N_WORKERS))]
+    for name, function, args in conversions:
+        n_images, seconds = time_call(function, *args)
+        results['converter_images_per_s'][name] = n_images / seconds
+        print('[STATE]: Converter {}: {:.1f} images/s'.format(name, n_images / seconds))
+
+    # Dataset load time
+    loaders = [('ndarray', lambda: nd.load(ndy_path)[0].wait_to_read()),
+               ('shards', lambda: converter.load_shards(shard_dir).wait_to_read()),
+               ('memmap', lambda: MemmapImageDataset(memmap_path)),
+               ('records', lambda: RecordDataset(record_dir)),
+               ('image_folder', lambda: CompressedImageDataset(img_dir))]
+    for name, function in loaders:
+        _, seconds = time_call(function)
+        results['load_time_s'][name] = seconds
+        print('[STATE]: Loading {}: {:.3f} s'.format(name, seconds))
+
+    # Iterator throughput
+    features = nd.load(ndy_path)[0]
+    memmap_features = MemmapImageDataset(memmap_path)
+    split_features, _ = train_test_split(features, ndy_path, train_fraction=1.)
+    iterators = [('ndarray_dataloader', data_loader(features)),
+                 ('ndarray_gather', GatherIterator(features, BATCH_SIZE)),
+                 ('ndarray_split_dataloader', data_loader(split_features)),
+                 ('ndarray_split_gather', GatherIterator(features, BATCH_SIZE, indices=split_features.indices)),
+                 ('ndarray_dataloader_prefetch', PrefetchIterator(data_loader(features), ctx)),
+                 ('memmap_dataloader', data_loader(memmap_features)),
+                 ('memmap_dataloader_prefetch', PrefetchIterator(data_loader(memmap_features), ctx)),
+                 ('memmap_dataloader_workers', data_loader(memmap_features, N_WORKERS)),
+                 ('records_dataloader_workers', data_loader(RecordDataset(record_dir), N_WORKERS)),
+                 ('image_folder_dataloader_workers', data_loader(CompressedImageDataset(img_dir), N_WORKERS))]
+    for name, batches in iterators:
+        batches_per_s = iterate_epochs(batches)
+        results['iterator_batches_per_s'][name] = batches_per_s
+        print('[STATE]: Iterator {}: {:.1f} batches/s'.format(name, batches_per_s))
+    return results
+
+
+if __name__ == '__main__':
+    output_path = sys.argv[1] if len(sys.argv) > 1 else OUTPUT_PATH
+    work_dir = tempfile.mkdtemp(prefix='input_pipeline_benchmark_')
+    try:
+        results = run_benchmark(work_dir)
+    finally:
+        shutil.rmtree(work_dir)
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('[STATE]: Results written to ' + output_path)
@@ -0,0 +1,39 @@
+from mxnet import nd
+
+# NDArrays that a training loop needs every batch but whose contents it
+# does not keep: the 1 and 0 labels of genuine and generated images, and the
+# latent noise fed to a generator. Instead of allocating them anew for every
+# batch, a BufferPool allocates one of each per name and shape (so per batch
+# size; the last batch of an epoch may be smaller) on its context and hands
+# the same array out again. Random buffers are refilled in place.
+#
+# A buffer is overwritten the next time it is asked for, so every use of it
+# must be queued before then; MXNet's engine orders the in-place fill after
+# every operation already queued on the array.
+
+
+class BufferPool(object):
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.buffers = {}
+
+    def _buffer(self, name, shape):
+        key = (name, tuple(shape))
+        if key not in self.buffers:
+            self.buffers[key] = nd.empty(shape, ctx=self.ctx)
+        return self.buffers[key]
+
+    def constant(self, name, shape, value):
+        # An array filled with value, filled only when it is allocated
+        key = (name, tuple(shape))
+        if key not in self.buffers:
+            self.buffers[key] = nd.full(shape, value, ctx=self.ctx)
+        return self.buffers[key]
+
+    def normal(self, name, shape, loc=0, scale=1):
+        # An array refilled in place with standard normal (or N(loc, scale))
+        # samples every time it is asked for
+        buffer = self._buffer(name, shape)
+        nd.random.normal(loc, scale, shape=shape, ctx=self.ctx, out=buffer)
+        return buffer
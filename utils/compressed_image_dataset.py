@@ -0,0 +1,147 @@
+import json
+import os
+import tarfile
+import zipfile
+import numpy as np
+from mxnet.gluon import data as gdata
+
+from convert_to_NDArray import decode_image_uint8
+from memmap_dataset import batchify_uint8, to_float_batch
+
+# A dataset that keeps the images compressed on disk and decodes them on
+# demand, for corpora that do not fit in memory even as uint8. The source
+# is either a directory of image files, a .zip archive or an uncompressed
+# .tar archive.
+#
+# An index of the members (and, for tar archives, their byte offsets) is
+# built once and cached next to the source, so opening a large archive does
+# not scan it again. Samples are decoded in whichever process reads them:
+# with gdata.DataLoader(..., num_workers=n) the decoding is spread over n
+# worker processes, and batchify_fn builds the batches in shared memory so
+# that they are handed back to the training process without a copy.
+#
+# Samples are uint8 arrays in the same (n_channels, width, height) layout
+# that convert_to_NDArray.py produces, decoded with its decode_image_uint8.
+
+
+def _source_signature(source):
+    stat = os.stat(source)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _build_index(source):
+    # Return the source kind and the list of its members; tar members are
+    # stored as [name, offset, size] so they can be read without tarfile
+    if os.path.isdir(source):
+        with os.scandir(source) as entries:
+            members = sorted(entry.name for entry in entries if entry.is_file())
+        return 'folder', members
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            members = [info.filename for info in archive.infolist() if not info.is_dir()]
+        return 'zip', members
+    if tarfile.is_tarfile(source):
+        members = []
+        # Mode 'r:' refuses compressed archives, which cannot be read at
+        # random offsets anyway
+        with tarfile.open(source, 'r:') as archive:
+            for info in archive:
+                if info.isfile():
+                    members.append([info.name, info.offset_data, info.size])
+        return 'tar', members
+    raise ValueError('{} is neither a directory, a zip archive nor an uncompressed tar archive'.format(source))
+
+
+def load_index(source, index_path=None):
+    # Load the cached member index of source, rebuilding it when the source
+    # changed since the index was written
+    if index_path is None:
+        index_path = source.rstrip('/') + '.index.json'
+    signature = _source_signature(source)
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index['signature'] == signature:
+            return index['kind'], index['members']
+    kind, members = _build_index(source)
+    with open(index_path, 'w') as f:
+        json.dump({'signature': signature, 'kind': kind, 'members': members}, f)
+    return kind, members
+
+
+class CompressedImageDataset(gdata.Dataset):
+
+    def __init__(self, source, index_path=None):
+        self.source = source
+        self.kind, self.members = load_index(source, index_path)
+
+        # Open file handles are per process; they are opened lazily so that
+        # every DataLoader worker gets its own
+        self._handle = None
+        self._handle_pid = None
+
+        # Decode the first image to expose the shape like an NDArray would
+        self.shape = (len(self.members),) + self[0].shape
+
+    def __len__(self):
+        return len(self.members)
+
+    def close(self):
+        # Close the archive handle of this process, if one is open; it is
+        # reopened when the next sample is read
+        if self._handle is not None and self._handle_pid == os.getpid():
+            if self.kind == 'zip':
+                self._handle.close()
+            else:
+                os.close(self._handle)
+        self._handle = None
+        self._handle_pid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # __init__ may have failed before the handles were set up
+        if hasattr(self, '_handle'):
+            self.close()
+
+    def _get_handle(self):
+        if self._handle_pid != os.getpid():
+            if self.kind == 'zip':
+                self._handle = zipfile.ZipFile(self.source)
+            elif self.kind == 'tar':
+                self._handle = os.open(self.source, os.O_RDONLY)
+            self._handle_pid = os.getpid()
+        return self._handle
+
+    def read_bytes(self, idx):
+        # Return the encoded bytes of the idx-th image
+        member = self.members[idx]
+        if self.kind == 'folder':
+            with open(os.path.join(self.source, member), 'rb') as f:
+                return f.read()
+        if self.kind == 'zip':
+            return self._get_handle().read(member)
+        # pread does not move a shared file position, so concurrent readers
+        # do not interfere with each other
+        _, offset, size = member
+        return os.pread(self._get_handle(), size, offset)
+
+    def __getitem__(self, idx):
+        # A single index returns the decoded uint8 image; a slice returns a
+        # float batch, which is what the validation code does with
+        # test_features[0:n]
+        if isinstance(idx, slice):
+            return to_float_batch(np.stack([self[i] for i in range(*idx.indices(len(self)))]))
+        return decode_image_uint8(self.read_bytes(idx)).asnumpy()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_handle'] = None
+        state['_handle_pid'] = None
+        return state
+
+    batchify_fn = staticmethod(batchify_uint8)
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+
+# The conversion manifest is a JSON-lines file kept next to a converted
+# dataset. Every line records one source image:
+#
+#   {"path": ..., "size": ..., "mtime": ..., "sha1": ..., "row": ...}
+#
+# where row is the index the image was written to, or null for a duplicate
+# that was dropped; the dedup index adds the image's difference hash as
+# dhash and, for duplicates, the path they duplicate as duplicate_of. Lines are appended only
+# after the rows they describe have been flushed to the dataset file, so
+# the manifest never points at data that is not on disk; an interrupted
+# conversion simply resumes after the last chunk that made it into the
+# manifest. When a path appears more than once, the last line wins.
+
+
+def content_sha1(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+class ConversionManifest(object):
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+
+        # Latest record for every path, and the number of rows that are
+        # covered by the manifest
+        self.records = {}
+        self.n_rows = 0
+
+        if os.path.exists(manifest_path):
+            self._load()
+
+    def _load(self):
+        with open(self.manifest_path, 'rb') as f:
+            content = f.read()
+
+        # Read records up to the first incomplete line; a crash while
+        # appending can leave a torn line at the end of the file
+        valid_size = 0
+        for line in content.splitlines(True):
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+            self._add(record)
+            valid_size += len(line)
+
+        # Cut the torn line off so that new records start on a fresh line
+        if valid_size < len(content):
+            with open(self.manifest_path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def _add(self, record):
+        self.records[record['path']] = record
+        if record['row'] is not None:
+            self.n_rows = max(self.n_rows, record['row'] + 1)
+
+    def get(self, path):
+        return self.records.get(path)
+
+    def is_unchanged(self, path, size, mtime):
+        # A file whose size and modification time match its record is
+        # assumed to be unchanged without reading it
+        record = self.records.get(path)
+        return record is not None and record['size'] == size and record['mtime'] == mtime
+
+    def append(self, records):
+        # Durably append a list of records; call this only after the rows
+        # they point to have been flushed
+        with open(self.manifest_path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        for record in records:
+            self._add(record)
@@ -2,8 +2,17 @@ import mxnet as mx
 from mxnet import nd, image as mximage
 import matplotlib.pyplot as plt
 import numpy as np
+import collections
+import multiprocessing
 import os
 
+from conversion_manifest import ConversionManifest, content_sha1
+from memmap_dataset import create_memmap, open_memmap, resize_memmap
+from record_dataset import RecordDataset, write_record_shard, write_records_index
+from pyramid_dataset import pyramid_path, write_pyramid
+from dedup_index import DedupIndex, dhash, write_dedup_report
+from dataset_statistics import compute_statistics, iter_dataset_chunks, save_statistics, statistics_path
+
 # This script is intended to be run from within the data processing script
 # Hence all paths are relative to the main directory
 
@@ -11,42 +20,415 @@ import os
 IMG_DIR = './data/anime_faces/'
 COLOR_CHANNELS = 'RGB'
 
-# List the names of the files
-img_filenames = os.listdir(IMG_DIR)
-img_paths = [IMG_DIR + filename for filename in img_filenames]
+# OUTPUT_FORMAT selects what the converter produces:
+#   'ndarray'  a single float32 NDArray named output (the original behavior),
+#              saved to NDARRAY_PATH
+#   'shards'   float32 NDArray files of SHARD_SIZE images each in SHARD_DIR,
+#              which can be loaded all together with load_shards
+#   'memmap'   a single uint8 memory-mapped file at MEMMAP_PATH, which can
+#              be opened with memmap_dataset.MemmapImageDataset; it is
+#              updated incrementally using a manifest at MEMMAP_PATH.manifest
+#   'records'  uint8 record shards of SHARD_SIZE images each with a byte
+#              offset index in RECORD_DIR, optionally compressed with
+#              RECORD_COMPRESSION, which can be opened with
+#              record_dataset.RecordDataset
+# All formats except 'ndarray' decode the images with a pool of N_WORKERS
+# processes
+OUTPUT_FORMAT = 'ndarray'
+NDARRAY_PATH = '../project_data/anime_faces.ndy'
+N_WORKERS = multiprocessing.cpu_count()
+SHARD_SIZE = 1024
+SHARD_DIR = '../project_data/anime_faces_shards/'
+MEMMAP_PATH = '../project_data/anime_faces.u8'
+RECORD_DIR = '../project_data/anime_faces_records/'
+RECORD_COMPRESSION = None
 
-# Read the first image to determine the shape
-dummy_img_array = mximage.imread(img_paths[0], 
-                                 flag = int(COLOR_CHANNELS == 'RGB'))
-# Because the imread() method will return NDArray object of
-# the shape (width, height, n_channels)
-# we will extract these dimensionalities and create a
-# 0 NDArray accordingly
-width, height, n_channels = dummy_img_array.shape
-# Finally, the number of samples can be extracted from the length of
-# the path list
-sample_size = len(img_paths)
-
-# Initialize a zero NDArray to hold all the images
-output = nd.zeros((sample_size, n_channels, width, height))
-
-# Iterate through all the paths
-for i in range(sample_size):
-    img_path = img_paths[i]
-    
+# After converting, the per-channel mean and std of the dataset (and the
+# mean image if WITH_MEAN_IMAGE is True) are computed in one streaming pass
+# and saved next to the dataset as <dataset>.stats.npz
+WITH_MEAN_IMAGE = False
+
+# The memmap conversion can look up every new image in an index of exact
+# (content hash) and near (perceptual hash) duplicates of the images
+# already converted. DEDUP selects what happens to a duplicate:
+#   None     no lookup
+#   'drop'   the duplicate is left out of the dataset and listed in the report
+# Only the 'memmap' OUTPUT_FORMAT deduplicates; setting DEDUP with another
+# format is an error. A changed file that turns out to duplicate
+# another image keeps its row and is listed in the report as 'kept', so
+# deduplicate before the first conversion rather than afterwards.
+# Near duplicates are images whose perceptual hashes differ in at most
+# DEDUP_MAX_DISTANCE of 64 bits. The report of every run is written to
+# MEMMAP_PATH.dedup_report.json
+DEDUP = None
+DEDUP_MAX_DISTANCE = 4
+
+# After a memmap conversion, downsampled copies of the dataset are written
+# for every size in PYRAMID_SIZES (see pyramid_dataset.py); they are used by
+# the progressive-resolution mode of train_VAE_GAN
+PYRAMID_SIZES = (16, 32)
+
+
+def iter_image_entries(img_dir):
+    # Stream the image files with os.scandir so that the listing of a large
+    # directory is never held in memory all at once
+    with os.scandir(img_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry
+
+
+def iter_image_paths(img_dir):
+    for entry in iter_image_entries(img_dir):
+        yield entry.path
+
+
+def iter_chunks(items, chunk_size):
+    # Group an iterable into lists of chunk_size items; the last list
+    # holds whatever is left over
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def decode_image_uint8(img_bytes):
     # Get the image NDArray; note that at this point
     # img_array is of shape (width, height, n_channels)
     # and of values 0 - 255
-    # so we need to divide by 255 to get a probabilistic representation
-    # and reshape it to be of the shape
+    # so we reshape it to be of the shape
     # (n_channels, width, height)
-    img_array = mximage.imread(img_path, 
-                               flag = int(COLOR_CHANNELS == 'RGB'))
-    img_array = img_array.astype(np.float32) / 255.
-    
-    
-    output[i] = img_array.reshape((n_channels, width, height))
-    
-    if (i+1) % 100 == 0:
-        print(str(i+1) + '/' + str(sample_size) + ' processed')
-        
\ No newline at end of file
+    img_array = mximage.imdecode(img_bytes,
+                                 flag = int(COLOR_CHANNELS == 'RGB'))
+    width, height, n_channels = img_array.shape
+    return img_array.reshape((n_channels, width, height))
+
+
+def read_image_uint8(img_path):
+    with open(img_path, 'rb') as f:
+        return decode_image_uint8(f.read())
+
+
+def read_image(img_path):
+    # Same as read_image_uint8, but divided by 255 to get a probabilistic
+    # representation
+    return read_image_uint8(img_path).astype(np.float32) / 255.
+
+
+def shard_path(shard_dir, shard_index):
+    return os.path.join(shard_dir, 'shard_{:05d}.ndy'.format(shard_index))
+
+
+def convert_shard(shard_args):
+    # Runs inside a worker process: decode and normalize one chunk of images
+    # and write them as a single shard, so that only one shard per worker
+    # is ever held in memory
+    shard_index, img_paths, shard_dir = shard_args
+    shard = nd.stack(*[read_image(img_path) for img_path in img_paths])
+    nd.save(shard_path(shard_dir, shard_index), [shard])
+    return len(img_paths)
+
+
+def convert_to_shards(img_dir = IMG_DIR,
+                      shard_dir = SHARD_DIR,
+                      shard_size = SHARD_SIZE,
+                      n_workers = N_WORKERS):
+    # Decode all images in img_dir with a pool of n_workers processes and
+    # write them into shard_dir as fixed-size shards. The directory is
+    # streamed and at most 2 shards per worker are in flight at any time,
+    # so memory use does not depend on the number of images
+    os.makedirs(shard_dir, exist_ok=True)
+    pool = multiprocessing.Pool(n_workers)
+    pending = collections.deque()
+    n_processed = 0
+    try:
+        shards = enumerate(iter_chunks(iter_image_paths(img_dir), shard_size))
+        for shard_index, img_paths in shards:
+            pending.append(pool.apply_async(convert_shard,
+                                            ((shard_index, img_paths, shard_dir),)))
+            # Wait for the oldest shard before submitting more work
+            if len(pending) >= 2 * n_workers:
+                n_processed += pending.popleft().get()
+                print(str(n_processed) + ' processed')
+        while len(pending) > 0:
+            n_processed += pending.popleft().get()
+            print(str(n_processed) + ' processed')
+    finally:
+        pool.close()
+        pool.join()
+    return n_processed
+
+
+def decode_chunk(img_paths):
+    # Runs inside a worker process: decode one chunk of images into a uint8
+    # array of shape (len(img_paths), n_channels, width, height), along with
+    # the content hash and the perceptual hash of every file
+    img_arrays = []
+    sha1s = []
+    dhashes = []
+    for img_path in img_paths:
+        with open(img_path, 'rb') as f:
+            img_bytes = f.read()
+        img_array = decode_image_uint8(img_bytes).asnumpy()
+        img_arrays.append(img_array)
+        sha1s.append(content_sha1(img_bytes))
+        dhashes.append(dhash(img_array))
+    return np.stack(img_arrays), sha1s, dhashes
+
+
+def iter_changed_images(img_dir, manifest):
+    # Yield (path, size, mtime) of the images that are not in the manifest
+    # or whose size or modification time differ from their record
+    for entry in iter_image_entries(img_dir):
+        stat = entry.stat()
+        if not manifest.is_unchanged(entry.path, stat.st_size, stat.st_mtime):
+            yield entry.path, stat.st_size, stat.st_mtime
+
+
+def convert_to_memmap(img_dir = IMG_DIR,
+                      memmap_path = MEMMAP_PATH,
+                      chunk_size = SHARD_SIZE,
+                      n_workers = N_WORKERS,
+                      dedup = DEDUP,
+                      dedup_max_distance = DEDUP_MAX_DISTANCE):
+    # Decode the images in img_dir with a pool of n_workers processes and
+    # write them as uint8 into a single memmap file.
+    #
+    # The conversion is incremental: a manifest next to the memmap file
+    # records every converted file, so only new or changed files are
+    # decoded. Changed files are rewritten in their old row and new files
+    # are appended. Every chunk is committed to the manifest once its rows
+    # are flushed, so an interrupted run resumes from the last finished
+    # chunk. The directory is streamed with at most 2 chunks per worker in
+    # flight.
+    #
+    # With dedup set, new files are looked up in a duplicate index rebuilt
+    # from the manifest, so they are only compared with the hashes of the
+    # earlier images and not with the images themselves. Dropped
+    # duplicates get a manifest record without a row, so they are not
+    # decoded again by the next run. Changed files keep their row even if
+    # they turn out to be duplicates.
+    if dedup not in (None, 'drop'):
+        raise ValueError('Unknown dedup mode {}'.format(dedup))
+    manifest = ConversionManifest(memmap_path + '.manifest')
+    output = None
+    if manifest.n_rows > 0 and os.path.exists(memmap_path):
+        output = open_memmap(memmap_path, mode='r+')
+    dedup_index = None
+    if dedup is not None:
+        dedup_index = DedupIndex.from_manifest(manifest, dedup_max_distance)
+    duplicates = []
+    # Rows past the ones covered by the manifest belong to an interrupted
+    # run and will be written again
+    n_rows = manifest.n_rows
+    pool = multiprocessing.Pool(n_workers)
+    pending = collections.deque()
+    n_processed = 0
+
+    def commit_chunk(chunk_files, result):
+        # Chunks are committed in order, so new rows are assigned here,
+        # after the duplicates among them are known
+        nonlocal output, n_rows
+        chunk, sha1s, dhashes = result
+        records = []
+        kept = []
+        for i, ((path, size, mtime), sha1, image_hash) in enumerate(zip(chunk_files, sha1s, dhashes)):
+            old_record = manifest.get(path)
+            row = old_record['row'] if old_record is not None else None
+            record = {'path': path, 'size': size, 'mtime': mtime, 'sha1': sha1, 'dhash': image_hash}
+            duplicate = None
+            if dedup_index is not None:
+                duplicate = dedup_index.find_duplicate(sha1, image_hash, exclude_row=row)
+            if duplicate is not None:
+                kind, duplicate_row, distance = duplicate
+                record['duplicate_of'] = dedup_index.row_paths[duplicate_row]
+                action = 'dropped' if row is None else 'kept'
+                duplicates.append({'path': path,
+                                   'duplicate_of': record['duplicate_of'],
+                                   'kind': kind,
+                                   'distance': distance,
+                                   'action': action})
+                if action == 'dropped':
+                    record['row'] = None
+                    records.append(record)
+                    continue
+            if row is None:
+                row = n_rows
+                n_rows += 1
+            record['row'] = row
+            records.append(record)
+            kept.append(i)
+            if dedup_index is not None:
+                dedup_index.add(row, path, sha1, image_hash)
+
+        rows = [records[i]['row'] for i in kept]
+        if len(rows) > 0:
+            required_rows = max(rows) + 1
+            if output is None:
+                output = create_memmap(memmap_path, (required_rows,) + chunk.shape[1:])
+            elif chunk.shape[1:] != output.shape[1:]:
+                raise ValueError('Images of shape {} do not match the dataset shape {}'.format(chunk.shape[1:],
+                                                                                           output.shape[1:]))
+            elif required_rows > output.shape[0]:
+                output = resize_memmap(memmap_path, required_rows)
+            output[rows] = chunk[kept]
+            output.flush()
+        manifest.append(records)
+        return len(records)
+
+    try:
+        for chunk_files in iter_chunks(iter_changed_images(img_dir, manifest), chunk_size):
+            img_paths = [path for path, _, _ in chunk_files]
+            pending.append((chunk_files, pool.apply_async(decode_chunk, (img_paths,))))
+            if len(pending) >= 2 * n_workers:
+                chunk_files, result = pending.popleft()
+                n_processed += commit_chunk(chunk_files, result.get())
+                print(str(n_processed) + ' new or changed images processed')
+        while len(pending) > 0:
+            chunk_files, result = pending.popleft()
+            n_processed += commit_chunk(chunk_files, result.get())
+            print(str(n_processed) + ' new or changed images processed')
+    finally:
+        pool.close()
+        pool.join()
+
+    # Drop rows left over by an interrupted run that were not redone
+    if output is not None and output.shape[0] != manifest.n_rows:
+        output = resize_memmap(memmap_path, manifest.n_rows)
+
+    if dedup is not None:
+        write_dedup_report(memmap_path + '.dedup_report.json', duplicates, n_processed)
+        print('{} duplicates found ({} dropped), report written to {}'.format(
+            len(duplicates),
+            sum(1 for d in duplicates if d['action'] == 'dropped'),
+            memmap_path + '.dedup_report.json'))
+    return n_processed
+
+
+def convert_record_shard(shard_args):
+    # Runs inside a worker process: decode one chunk of images and write it
+    # as a record shard, so that shards are written in parallel
+    shard_index, img_paths, record_dir, compression = shard_args
+    chunk, _, _ = decode_chunk(img_paths)
+    return chunk.shape[1:], write_record_shard(record_dir, shard_index, chunk, compression)
+
+
+def convert_to_records(img_dir = IMG_DIR,
+                       record_dir = RECORD_DIR,
+                       shard_size = SHARD_SIZE,
+                       compression = RECORD_COMPRESSION,
+                       n_workers = N_WORKERS):
+    # Decode all images in img_dir with a pool of n_workers processes, each
+    # of which writes whole record shards. records.json is rewritten as the
+    # shards finish in order, so the finished part of the dataset can be
+    # read at any time; at most 2 shards per worker are in flight
+    os.makedirs(record_dir, exist_ok=True)
+    pool = multiprocessing.Pool(n_workers)
+    pending = collections.deque()
+    shards = []
+    n_processed = 0
+
+    def commit_shard(result):
+        sample_shape, shard = result
+        shards.append(shard)
+        write_records_index(record_dir, sample_shape, shards)
+        return shard['n_records']
+
+    try:
+        chunks = enumerate(iter_chunks(iter_image_paths(img_dir), shard_size))
+        for shard_index, img_paths in chunks:
+            pending.append(pool.apply_async(convert_record_shard,
+                                            ((shard_index, img_paths, record_dir, compression),)))
+            if len(pending) >= 2 * n_workers:
+                n_processed += commit_shard(pending.popleft().get())
+                print(str(n_processed) + ' processed')
+        while len(pending) > 0:
+            n_processed += commit_shard(pending.popleft().get())
+            print(str(n_processed) + ' processed')
+    finally:
+        pool.close()
+        pool.join()
+    return n_processed
+
+
+def write_statistics(chunks, dataset_path, with_mean_image = WITH_MEAN_IMAGE):
+    # Compute the statistics of a converted dataset in one streaming pass
+    # over its chunks (see dataset_statistics.iter_dataset_chunks) and save
+    # them next to it
+    statistics = compute_statistics(chunks, with_mean_image = with_mean_image)
+    save_statistics(statistics_path(dataset_path), statistics)
+    print('Channel means {}, channel stds {} written to {}'.format(statistics['mean'],
+                                                                   statistics['std'],
+                                                                   statistics_path(dataset_path)))
+
+
+def iter_shards(shard_dir = SHARD_DIR):
+    # Load the shards written by convert_to_shards one at a time, in shard
+    # order, as NDArrays of shape (shard_size, n_channels, width, height)
+    shard_filenames = sorted(filename for filename in os.listdir(shard_dir)
+                             if filename.startswith('shard_') and filename.endswith('.ndy'))
+    for filename in shard_filenames:
+        yield nd.load(os.path.join(shard_dir, filename))[0]
+
+
+def load_shards(shard_dir = SHARD_DIR):
+    # Load all shards written by convert_to_shards, in shard order, into a
+    # single NDArray of shape (sample_size, n_channels, width, height)
+    return nd.concat(*iter_shards(shard_dir), dim=0)
+
+
+if __name__ == '__main__':
+    if DEDUP is not None and OUTPUT_FORMAT != 'memmap':
+        raise ValueError('DEDUP is only supported by the memmap output format, not {}'.format(OUTPUT_FORMAT))
+    if OUTPUT_FORMAT == 'shards':
+        sample_size = convert_to_shards()
+        print(str(sample_size) + ' images written to ' + SHARD_DIR)
+        # The statistics are accumulated shard by shard, so that the shards
+        # are never all in memory at once
+        write_statistics((shard.asnumpy() for shard in iter_shards()), os.path.join(SHARD_DIR, 'shards'))
+    elif OUTPUT_FORMAT == 'memmap':
+        sample_size = convert_to_memmap()
+        print(str(sample_size) + ' images written to ' + MEMMAP_PATH)
+        write_statistics(iter_dataset_chunks(open_memmap(MEMMAP_PATH)), MEMMAP_PATH)
+        write_pyramid(MEMMAP_PATH, PYRAMID_SIZES)
+        for size in PYRAMID_SIZES:
+            print('{0}x{0} copies written to {1}'.format(size, pyramid_path(MEMMAP_PATH, size)))
+    elif OUTPUT_FORMAT == 'records':
+        sample_size = convert_to_records()
+        print(str(sample_size) + ' images written to ' + RECORD_DIR)
+        with RecordDataset(RECORD_DIR) as records:
+            write_statistics(iter_dataset_chunks(records), os.path.join(RECORD_DIR, 'records'))
+    else:
+        # List the names of the files
+        img_filenames = os.listdir(IMG_DIR)
+        img_paths = [IMG_DIR + filename for filename in img_filenames]
+
+        # Read the first image to determine the shape
+        dummy_img_array = mximage.imread(img_paths[0],
+                                         flag = int(COLOR_CHANNELS == 'RGB'))
+        # Because the imread() method will return NDArray object of
+        # the shape (width, height, n_channels)
+        # we will extract these dimensionalities and create a
+        # 0 NDArray accordingly
+        width, height, n_channels = dummy_img_array.shape
+        # Finally, the number of samples can be extracted from the length of
+        # the path list
+        sample_size = len(img_paths)
+
+        # Initialize a zero NDArray to hold all the images
+        output = nd.zeros((sample_size, n_channels, width, height))
+
+        # Iterate through all the paths
+        for i in range(sample_size):
+            output[i] = read_image(img_paths[i])
+
+            if (i+1) % 100 == 0:
+                print(str(i+1) + '/' + str(sample_size) + ' processed')
+
+        nd.save(NDARRAY_PATH, [output])
+        print(str(sample_size) + ' images written to ' + NDARRAY_PATH)
+        write_statistics(iter_dataset_chunks(output), NDARRAY_PATH)
@@ -0,0 +1,90 @@
+import numpy as np
+import mxnet as mx
+from mxnet import nd
+
+from dataset_split import train_test_split
+from shared_dataset import attach_or_load
+
+# Coresets for fast hyperparameter exploration: a small, diverse subset of
+# the training set that ranks configurations the way the full set does, at
+# a fraction of the cost per epoch.
+#
+# The training images are embedded in batches, either with a cheap feature
+# extractor (the image shrunk to 8x8 block means) or with the encoder of a
+# trained VAE, and a subset is picked with greedy k-center selection: every
+# next image is the one farthest from all images picked so far, so the
+# subset covers the embedding space instead of its densest regions. The
+# subset is saved as an .npy file of row indices into the training
+# features, which train_VAE_GAN reads through its subset_indices_path.
+#
+# Run from the main directory to build the coreset of the anime training
+# split:
+#   python utils/coreset.py
+
+DATASET_PATH = '../project_data/anime_faces.ndy'
+CORESET_FRACTION = 0.1
+SEED = 0
+
+
+def coreset_path(dataset_path, n_select, seed=0):
+    return '{}.coreset{}_seed{}.npy'.format(dataset_path, n_select, seed)
+
+
+def pooled_pixels(batch, size=8):
+    # Cheap embedding: the images shrunk to size x size block means in the
+    # real pixel layout, flattened. batch is in the stored (batch_size,
+    # n_channels, width, height) layout of reshaped pixel arrays
+    batch_size, n_channels, width, height = batch.shape
+    images = batch.reshape((batch_size, width, height, n_channels)).transpose((0, 3, 1, 2))
+    images = nd.Pooling(images, kernel=(width // size, height // size),
+                        stride=(width // size, height // size), pool_type='avg')
+    return images.reshape((batch_size, -1))
+
+
+def vae_latent_means(vae_net):
+    # Embedding with the encoder of a trained VAE: the latent means
+    def embed(batch):
+        return nd.split(vae_net.encoder(batch), axis=1, num_outputs=2)[0]
+    return embed
+
+
+def embed_features(features, embed=pooled_pixels, batch_size=256, ctx=mx.cpu()):
+    # Embed features (an NDArray or a dataset whose slices are float
+    # batches) in batches; return a numpy array of shape (n_samples, n_dims)
+    embeddings = []
+    for start in range(0, len(features), batch_size):
+        batch = features[start:start + batch_size].as_in_context(ctx)
+        embeddings.append(embed(batch).asnumpy())
+    return np.concatenate(embeddings, axis=0)
+
+
+def k_center_greedy(embeddings, n_select, seed=0):
+    # Greedy k-center selection; returns the indices of n_select rows of
+    # embeddings in the order they were picked
+    embeddings = embeddings.astype(np.float32)
+    squared_norms = (embeddings * embeddings).sum(axis=1)
+    first = np.random.RandomState(seed).randint(embeddings.shape[0])
+    selected = [first]
+    # Squared distance of every row to its nearest selected row
+    min_distances = squared_norms - 2 * embeddings.dot(embeddings[first]) + squared_norms[first]
+    for _ in range(n_select - 1):
+        farthest = int(np.argmax(min_distances))
+        selected.append(farthest)
+        distances = squared_norms - 2 * embeddings.dot(embeddings[farthest]) + squared_norms[farthest]
+        np.minimum(min_distances, distances, out=min_distances)
+    return np.array(selected, dtype=np.int64)
+
+
+def build_coreset(features, n_select, embed=pooled_pixels, seed=0, ctx=mx.cpu()):
+    # Return the sorted row indices of a k-center coreset of features
+    return np.sort(k_center_greedy(embed_features(features, embed, ctx=ctx), n_select, seed))
+
+
+if __name__ == '__main__':
+    all_features = attach_or_load(DATASET_PATH)
+    train_features, _ = train_test_split(all_features, DATASET_PATH, train_fraction=0.8, seed=0)
+    n_select = int(len(train_features) * CORESET_FRACTION)
+    print('[STATE]: Selecting {} of {} training images'.format(n_select, len(train_features)))
+    indices = build_coreset(train_features, n_select, seed=SEED)
+    np.save(coreset_path(DATASET_PATH, n_select, SEED), indices)
+    print('[STATE]: Coreset indices written to ' + coreset_path(DATASET_PATH, n_select, SEED))
@@ -0,0 +1,97 @@
+import os
+import numpy as np
+from mxnet import nd
+from mxnet.gluon import data as gdata
+
+from memmap_dataset import to_float_ndarray
+
+# Train/test splits that do not copy the data. A split is a seeded
+# permutation of the row indices, saved next to the dataset so that every
+# run (and every run of a sweep) uses the same split without shuffling the
+# data again. The train and test sets are views that gather their rows from
+# the underlying features only when a sample or a batch is requested.
+
+
+def permutation_path(dataset_path, seed):
+    return '{}.permutation_seed{}.npy'.format(dataset_path, seed)
+
+
+def load_or_create_permutation(dataset_path, sample_size, seed=0):
+    # Load the saved permutation of the dataset, or create and save it when
+    # there is none yet or the dataset size changed. Concurrent runs may
+    # create it at the same time, so it is written to a file of this process
+    # and renamed into place once complete; the permutations they write are
+    # identical
+    path = permutation_path(dataset_path, seed)
+    if os.path.exists(path):
+        permutation = np.load(path)
+        if permutation.shape[0] == sample_size:
+            return permutation
+    permutation = np.random.RandomState(seed).permutation(sample_size)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, permutation)
+    os.replace(tmp_path, path)
+    return permutation
+
+
+def train_test_split(features, dataset_path, train_fraction=0.8, seed=0):
+    # Split features (an NDArray or a Dataset) into train and test views
+    # using the saved permutation of the dataset at dataset_path
+    permutation = load_or_create_permutation(dataset_path, len(features), seed)
+    n_train = int(len(features) * train_fraction)
+    return SubsetDataset(features, permutation[:n_train]), SubsetDataset(features, permutation[n_train:])
+
+
+class SubsetDataset(gdata.Dataset):
+
+    def __init__(self, features, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        # A subset of a subset is a subset of the underlying features
+        if isinstance(features, SubsetDataset):
+            indices = features.indices[indices]
+            features = features.features
+        self.features = features
+        self.indices = indices
+
+        # Expose the shape like an NDArray would so that the view can be
+        # passed wherever the training scripts expect train_features
+        self.shape = (len(self.indices),) + tuple(features.shape[1:])
+
+        # Samples come from the underlying features, so batches are built
+        # the way the underlying features build them
+        if hasattr(features, 'batchify_fn'):
+            self.batchify_fn = features.batchify_fn
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        # A single index returns a sample of the underlying features; a
+        # slice returns a batch, which is what the validation code does with
+        # test_features[0:n]
+        if isinstance(idx, slice):
+            return self.take(np.arange(*idx.indices(len(self))))
+        return self.features[int(self.indices[idx])]
+
+    def take(self, rows):
+        # Gather the given rows of the subset (positions 0 to len(self) - 1,
+        # like the rows of any other dataset) into one float batch with
+        # values in [0, 1]
+        rows = self.indices[np.asarray(rows, dtype=np.int64)]
+        if isinstance(self.features, nd.NDArray):
+            return to_float_ndarray(nd.take(self.features, nd.array(rows, ctx=self.features.context)))
+        if hasattr(self.features, 'take'):
+            return self.features.take(rows)
+        batchify_fn = getattr(self, 'batchify_fn', gdata.dataloader.default_batchify_fn)
+        return batchify_fn([self.features[int(row)] for row in rows])
+
+    def to_ndarray(self, ctx=None):
+        # Gather the rows of the subset into one NDArray in the dtype of the
+        # underlying features (uint8 for the uint8 datasets), e.g. to keep a
+        # train split resident for gather_iterator.GatherIterator
+        if isinstance(self.features, nd.NDArray):
+            rows = nd.take(self.features, nd.array(self.indices, ctx=self.features.context))
+            return rows if ctx is None else rows.as_in_context(ctx)
+        rows = np.stack([np.asarray(self.features[int(row)]) for row in self.indices])
+        return nd.array(rows, dtype=rows.dtype, ctx=ctx)
@@ -0,0 +1,75 @@
+import numpy as np
+from mxnet import nd
+
+# Per-channel mean and standard deviation (and optionally the mean image)
+# of a dataset, computed once by the converter and saved next to the
+# dataset so that training runs do not have to recompute them.
+#
+# Pixel values are measured on the [0, 1] scale that the training batches
+# use. The statistics are laid out for the stored (n_channels, width,
+# height) tensors, which are the (width, height, n_channels) pixel arrays
+# reshaped: the channel of a value is its flat position modulo n_channels.
+
+
+def statistics_path(dataset_path):
+    return dataset_path + '.stats.npz'
+
+
+def compute_statistics(chunks, n_channels=None, with_mean_image=False):
+    # Compute the statistics in one streaming pass over chunks, an iterable
+    # of arrays of shape (chunk_size, n_channels, width, height) that are
+    # either uint8 (0 - 255) or float ([0, 1]). Only one chunk is held at a
+    # time; n_channels is taken from the first chunk when it is None
+    channel_sums = None
+    channel_square_sums = None
+    image_sum = None
+    n_samples = 0
+    n_values = 0
+    for chunk in chunks:
+        if n_channels is None:
+            n_channels = chunk.shape[1]
+        if channel_sums is None:
+            channel_sums = np.zeros(n_channels, dtype=np.float64)
+            channel_square_sums = np.zeros(n_channels, dtype=np.float64)
+        scale = 255. if chunk.dtype == np.uint8 else 1.
+        chunk = np.asarray(chunk, dtype=np.float64) / scale
+        pixels = chunk.reshape((-1, n_channels))
+        channel_sums += pixels.sum(axis=0)
+        channel_square_sums += (pixels * pixels).sum(axis=0)
+        if with_mean_image:
+            image_sum = chunk.sum(axis=0) if image_sum is None else image_sum + chunk.sum(axis=0)
+        n_samples += chunk.shape[0]
+        n_values += pixels.shape[0]
+
+    mean = channel_sums / n_values
+    statistics = {'mean': mean,
+                  'std': np.sqrt(np.maximum(channel_square_sums / n_values - mean * mean, 0)),
+                  'n_samples': n_samples}
+    if with_mean_image:
+        statistics['mean_image'] = image_sum / n_samples
+    return statistics
+
+
+def iter_dataset_chunks(features, chunk_size=256):
+    # Read an array-like dataset (NDArray, numpy array or memmap) in chunks
+    for start in range(0, features.shape[0], chunk_size):
+        chunk = features[start:start + chunk_size]
+        yield chunk.asnumpy() if isinstance(chunk, nd.NDArray) else chunk
+
+
+def save_statistics(path, statistics):
+    np.savez(path, **statistics)
+
+
+def load_statistics(path, ctx):
+    # Load saved statistics as NDArrays on ctx, shaped for broadcasting
+    # against a batch with models/utilities.subtract_img_mean_batch:
+    # mean and std are (1, 1, n_channels), mean_image is
+    # (1, n_channels, width, height)
+    saved = np.load(path)
+    n_channels = saved['mean'].shape[0]
+    statistics = {'mean': nd.array(saved['mean'].reshape((1, 1, n_channels)), ctx=ctx),
+                  'std': nd.array(saved['std'].reshape((1, 1, n_channels)), ctx=ctx)}
+    if 'mean_image' in saved:
+        statistics['mean_image'] = nd.array(saved['mean_image'][np.newaxis], ctx=ctx)
+    return statistics
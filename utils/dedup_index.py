@@ -0,0 +1,118 @@
+import json
+import numpy as np
+
+# An index of the images in a converted dataset for finding exact and near
+# duplicates while new images are ingested.
+#
+# Exact duplicates are found by the SHA-1 of the file content. Near
+# duplicates are found by a 64 bit difference hash (dHash) of the image:
+# the image is turned gray, shrunk to hash_size x (hash_size + 1) block
+# means, and every bit says whether a block is brighter than its left
+# neighbour. Re-encoded, slightly resized or recolored copies of an image
+# get hashes that differ in only a few bits.
+#
+# Comparing a new hash with every hash in the index would make ingestion
+# quadratic, so the hash is cut into n_bands bands and the index keeps a
+# bucket of rows for every band value. Candidates are the rows that share
+# at least one band with the new hash; two hashes that differ in fewer
+# than n_bands bits always share a band, so no near duplicate within
+# max_distance < n_bands bits is missed.
+
+HASH_BITS = 64
+
+
+def dhash(sample, hash_size=8):
+    # sample is a uint8 image in the stored (n_channels, width, height)
+    # layout, i.e. its (width, height, n_channels) pixel array reshaped
+    n_channels, width, height = sample.shape
+    gray = sample.reshape((width, height, n_channels)).astype(np.float32).mean(axis=2)
+
+    # Block means over a hash_size x (hash_size + 1) grid
+    row_edges = np.linspace(0, width, hash_size + 1).astype(np.int64)
+    col_edges = np.linspace(0, height, hash_size + 2).astype(np.int64)
+    blocks = np.add.reduceat(np.add.reduceat(gray, row_edges[:-1], axis=0), col_edges[:-1], axis=1)
+    blocks /= np.outer(np.diff(row_edges), np.diff(col_edges)).clip(min=1)
+
+    bits = (blocks[:, 1:] > blocks[:, :-1]).flatten()
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class DedupIndex(object):
+
+    def __init__(self, max_distance=4, n_bands=8):
+        if max_distance >= n_bands:
+            raise ValueError('max_distance must be smaller than n_bands ({} >= {})'.format(max_distance,
+                                                                                       n_bands))
+        self.max_distance = max_distance
+        self.n_bands = n_bands
+        self.band_bits = HASH_BITS // n_bands
+
+        # Current content of every indexed row; the lookup tables below can
+        # hold stale rows of images that were changed since, which are
+        # filtered out against these
+        self.row_sha1s = {}
+        self.row_dhashes = {}
+        self.row_paths = {}
+
+        self.sha1_rows = {}
+        self.band_rows = {}
+
+    def _bands(self, image_hash):
+        mask = (1 << self.band_bits) - 1
+        return [(band, (image_hash >> (band * self.band_bits)) & mask) for band in range(self.n_bands)]
+
+    def add(self, row, path, sha1, image_hash=None):
+        self.row_sha1s[row] = sha1
+        self.row_paths[row] = path
+        self.sha1_rows[sha1] = row
+        if image_hash is not None:
+            self.row_dhashes[row] = image_hash
+            for band in self._bands(image_hash):
+                self.band_rows.setdefault(band, set()).add(row)
+
+    def find_duplicate(self, sha1, image_hash=None, exclude_row=None):
+        # Return (kind, row, distance) of an indexed image that the given
+        # image duplicates, kind being 'exact' or 'near', or None
+        row = self.sha1_rows.get(sha1)
+        if row is not None and row != exclude_row and self.row_sha1s.get(row) == sha1:
+            return 'exact', row, 0
+        if image_hash is None:
+            return None
+
+        best = None
+        candidates = set()
+        for band in self._bands(image_hash):
+            candidates.update(self.band_rows.get(band, ()))
+        for row in candidates:
+            if row == exclude_row or row not in self.row_dhashes:
+                continue
+            distance = hamming_distance(image_hash, self.row_dhashes[row])
+            if distance <= self.max_distance and (best is None or distance < best[2]):
+                best = ('near', row, distance)
+        return best
+
+    @classmethod
+    def from_manifest(cls, manifest, max_distance=4, n_bands=8):
+        # Rebuild the index from the records of a ConversionManifest, so
+        # that an incremental conversion dedups new images against
+        # everything converted before without reading it again
+        index = cls(max_distance, n_bands)
+        for record in manifest.records.values():
+            if record['row'] is not None:
+                index.add(record['row'], record['path'], record['sha1'], record.get('dhash'))
+        return index
+
+
+def write_dedup_report(report_path, duplicates, n_images):
+    # duplicates is a list of dicts describing every duplicate found, with
+    # the keys path, duplicate_of, kind, distance and action
+    with open(report_path, 'w') as f:
+        json.dump({'n_images': n_images,
+                   'n_exact': sum(1 for d in duplicates if d['kind'] == 'exact'),
+                   'n_near': sum(1 for d in duplicates if d['kind'] == 'near'),
+                   'n_dropped': sum(1 for d in duplicates if d['action'] == 'dropped'),
+                   'duplicates': duplicates}, f, indent=1)
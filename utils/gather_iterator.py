@@ -0,0 +1,69 @@
+import math
+from mxnet import nd
+
+from dataset_split import SubsetDataset
+from memmap_dataset import to_float_ndarray
+
+# A batch iterator for datasets that are held whole as NDArrays. Instead of
+# assembling every batch sample by sample in Python like gdata.DataLoader,
+# it shuffles an index array once per epoch and builds every batch with a
+# single nd.take, so the per-batch cost does not grow with the batch size
+# and stays on the device the arrays live on.
+#
+# arrays is one NDArray, or a list of NDArrays whose rows line up (e.g.
+# features and labels), in which case tuples of batches are produced.
+# indices optionally restricts the iterator to those rows, e.g. the rows of
+# a train split. As with last_batch='keep', the last batch of an epoch
+# holds whatever rows are left over.
+#
+# uint8 arrays (images with values 0 - 255) come out as float32 batches
+# with values in [0, 1], so a dataset can stay resident as uint8. Instead of
+# an NDArray, an array may also be a resident dataset (one with resident set
+# to True, such as mnist_cache.ResidentPackedImages) that gathers its float
+# batches itself with take.
+
+
+def is_resident(features):
+    return isinstance(features, nd.NDArray) or getattr(features, 'resident', False)
+
+
+def resident_arrays(features):
+    # Return the NDArray (or resident dataset) and the row indices that
+    # features are held in, or None if features are not held whole on a
+    # device
+    if is_resident(features):
+        return features, None
+    if isinstance(features, SubsetDataset) and is_resident(features.features):
+        return features.features, features.indices
+    return None
+
+
+def gather(array, batch_indices):
+    # Gather the rows of a batch from an NDArray or a resident dataset
+    if isinstance(array, nd.NDArray):
+        return to_float_ndarray(nd.take(array, batch_indices))
+    return array.take(batch_indices)
+
+
+class GatherIterator(object):
+
+    def __init__(self, arrays, batch_size, shuffle=True, indices=None):
+        self.single = not isinstance(arrays, (list, tuple))
+        self.arrays = [arrays] if self.single else list(arrays)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        ctx = self.arrays[0].context
+        if indices is None:
+            self.indices = nd.arange(self.arrays[0].shape[0], ctx=ctx)
+        else:
+            self.indices = nd.array(indices, ctx=ctx)
+
+    def __len__(self):
+        return int(math.ceil(self.indices.shape[0] / float(self.batch_size)))
+
+    def __iter__(self):
+        order = nd.random.shuffle(self.indices) if self.shuffle else self.indices
+        for start in range(0, order.shape[0], self.batch_size):
+            batch_indices = order[start:start + self.batch_size]
+            batches = tuple(gather(array, batch_indices) for array in self.arrays)
+            yield batches[0] if self.single else batches
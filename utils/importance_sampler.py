@@ -0,0 +1,91 @@
+import math
+import numpy as np
+from mxnet import nd
+from mxnet.gluon import data as gdata
+
+from memmap_dataset import to_float_ndarray
+
+# Loss-driven importance sampling: instead of visiting every training image
+# once per epoch, batches are drawn with probability proportional to a
+# running estimate of each image's loss, so the steps go to the images that
+# are not reconstructed well yet.
+#
+# The sampler keeps a table with an exponential moving average of the
+# per-sample loss, updated from the per-sample losses the training loop
+# computes anyway. To keep every image reachable, the sampling distribution
+# is mixed with the uniform one:
+#   p_i = (1 - uniform_mix) * loss_i / sum(loss) + uniform_mix / n_samples
+# Sampling by p biases the loss towards hard images, so every sample comes
+# with the importance weight 1 / (n_samples * p_i); the weighted mean of the
+# per-sample losses is an unbiased estimate of their uniform mean. Images
+# that were never seen yet get the largest loss in the table, so they are
+# visited early.
+
+
+class LossImportanceSampler(object):
+
+    def __init__(self, n_samples, batch_size, smoothing=0.9, uniform_mix=0.1, seed=None):
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+        self.smoothing = smoothing
+        self.uniform_mix = uniform_mix
+        self.random_state = np.random.RandomState(seed)
+
+        self.losses = np.ones(n_samples, dtype=np.float64)
+        self.seen = np.zeros(n_samples, dtype=bool)
+
+    def __len__(self):
+        # An epoch draws as many batches as a uniform pass over the data
+        return int(math.ceil(self.n_samples / float(self.batch_size)))
+
+    def probabilities(self):
+        losses = self.losses.copy()
+        if self.seen.any():
+            losses[~self.seen] = losses[self.seen].max()
+        return (1 - self.uniform_mix) * losses / losses.sum() + self.uniform_mix / self.n_samples
+
+    def sample_batch(self):
+        # Return the row indices of a batch and their importance weights
+        probabilities = self.probabilities()
+        indices = self.random_state.choice(self.n_samples, size=self.batch_size, p=probabilities)
+        weights = 1. / (self.n_samples * probabilities[indices])
+        return indices, weights.astype(np.float32)
+
+    def update(self, indices, losses):
+        # Fold the per-sample losses of a batch into the table; the first
+        # loss of a sample replaces its initial value
+        indices = np.asarray(indices, dtype=np.int64)
+        losses = np.asarray(losses, dtype=np.float64).reshape((-1,))
+        previous = np.where(self.seen[indices], self.losses[indices], losses)
+        self.losses[indices] = self.smoothing * previous + (1 - self.smoothing) * losses
+        self.seen[indices] = True
+
+
+class ImportanceBatchIterator(object):
+    # Draw len(sampler) batches of features per epoch with the sampler and
+    # produce (batch, indices, weights) tuples of NDArrays. The indices are
+    # rows of features (of the split, for a train split), and batches are
+    # gathered with nd.take for NDArrays, with the take method of the
+    # features when they have one (splits, memmap datasets), otherwise
+    # sample by sample. Batches are float with values in [0, 1] whatever
+    # the features are stored as
+
+    def __init__(self, features, sampler):
+        self.features = features
+        self.sampler = sampler
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def _take(self, indices):
+        if isinstance(self.features, nd.NDArray):
+            return to_float_ndarray(nd.take(self.features, nd.array(indices, ctx=self.features.context)))
+        if hasattr(self.features, 'take'):
+            return self.features.take(indices)
+        batchify_fn = getattr(self.features, 'batchify_fn', gdata.dataloader.default_batchify_fn)
+        return batchify_fn([self.features[int(i)] for i in indices])
+
+    def __iter__(self):
+        for _ in range(len(self)):
+            indices, weights = self.sampler.sample_batch()
+            yield self._take(indices), nd.array(indices), nd.array(weights)
@@ -0,0 +1,36 @@
+import numpy as np
+from mxnet import nd
+
+# Loss accounting that does not stall the training loop. Reading a loss
+# with asscalar() after every batch blocks until the device has finished
+# that batch, so MXNet's asynchronous engine can never run ahead and
+# overlap the next batch with the current one.
+#
+# A LossAccumulator keeps the mean loss of every batch as a scalar NDArray
+# on the device the loss was computed on, and only copies them to the host
+# when a mean is asked for. The epoch mean is the numpy mean of the float32
+# batch means, exactly as when every batch mean was read with asscalar().
+
+
+class LossAccumulator(object):
+
+    def __init__(self):
+        self.batch_losses = []
+
+    def __len__(self):
+        return len(self.batch_losses)
+
+    def reset(self):
+        self.batch_losses = []
+
+    def add(self, losses):
+        # Record the mean of a batch of (per-sample) losses without waiting
+        # for it to be computed
+        self.batch_losses.append(nd.mean(losses))
+
+    def mean(self):
+        # Return the mean of the batch losses recorded so far, or None if
+        # there are none; this waits for all of them to be computed
+        if not self.batch_losses:
+            return None
+        return np.mean(nd.concat(*self.batch_losses, dim=0).asnumpy())
@@ -0,0 +1,144 @@
+import json
+import numpy as np
+import mxnet as mx
+from mxnet import nd
+from mxnet.gluon import data as gdata
+
+# A compact on-disk format for image datasets: the images are stored as
+# uint8 in a single memory-mapped file so that opening a dataset is close
+# to instant and only the pages that are actually read become resident.
+#
+# File layout:
+#   HEADER_SIZE bytes   magic string followed by a JSON header holding the
+#                       shape and dtype of the array, padded with spaces
+#   remaining bytes     the raw array in C order
+#
+# The images keep the (sample_size, n_channels, width, height) layout that
+# convert_to_NDArray.py uses for the float32 NDArray, so a batch read from
+# this format is identical to the same rows of anime_faces.ndy
+
+MAGIC = b'VAEGANMM'
+HEADER_SIZE = 256
+
+
+def _header_bytes(shape, dtype):
+    header = json.dumps({'shape': [int(n) for n in shape],
+                         'dtype': np.dtype(dtype).name}).encode('utf-8')
+    header = MAGIC + header
+    if len(header) > HEADER_SIZE:
+        raise ValueError('Memmap header does not fit in {} bytes'.format(HEADER_SIZE))
+    return header + b' ' * (HEADER_SIZE - len(header))
+
+
+def read_memmap_header(path):
+    # Return the (shape, dtype) recorded in the header of a memmap file
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise ValueError('{} is not a memmap dataset file'.format(path))
+    header = json.loads(header[len(MAGIC):].decode('utf-8'))
+    return tuple(header['shape']), np.dtype(header['dtype'])
+
+
+def write_memmap_header(path, shape, dtype='uint8'):
+    # Rewrite the header of an existing memmap file in place, e.g. after
+    # rows were appended to it
+    with open(path, 'r+b') as f:
+        f.write(_header_bytes(shape, dtype))
+
+
+def create_memmap(path, shape, dtype='uint8'):
+    # Create a new memmap file of the given shape and return a writable
+    # view of its array
+    with open(path, 'wb') as f:
+        f.write(_header_bytes(shape, dtype))
+    return np.memmap(path, dtype=dtype, mode='r+', offset=HEADER_SIZE, shape=tuple(shape))
+
+
+def resize_memmap(path, n_rows):
+    # Grow or shrink an existing memmap file to n_rows along its first axis
+    # and return a writable view of the resized array
+    shape, dtype = read_memmap_header(path)
+    shape = (n_rows,) + tuple(shape[1:])
+    with open(path, 'r+b') as f:
+        f.truncate(HEADER_SIZE + int(np.prod(shape)) * dtype.itemsize)
+        f.write(_header_bytes(shape, dtype))
+    return np.memmap(path, dtype=dtype, mode='r+', offset=HEADER_SIZE, shape=shape)
+
+
+def open_memmap(path, mode='r'):
+    # Open the array of an existing memmap file without reading it
+    shape, dtype = read_memmap_header(path)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=HEADER_SIZE, shape=shape)
+
+
+# Context of the batches built by batchify_uint8. DataLoader worker
+# processes hand NDArrays in this context back to the main process through
+# shared memory instead of pickling their contents
+SHARED_CTX = mx.Context('cpu_shared', 0)
+
+
+def to_float_batch(uint8_batch, ctx=None):
+    # Turn a uint8 batch of images into a float32 NDArray with values in [0, 1]
+    float_batch = np.asarray(uint8_batch, dtype=np.float32)
+    float_batch /= 255.
+    return nd.array(float_batch, dtype=np.float32, ctx=ctx)
+
+
+def to_float_ndarray(batch):
+    # Turn a uint8 NDArray batch of images (e.g. gathered from a dataset held
+    # resident as uint8) into float32 with values in [0, 1]; float batches
+    # are returned as they are
+    if batch.dtype == np.uint8:
+        return batch.astype('float32') / 255.
+    return batch
+
+
+def batchify_uint8(samples):
+    # batchify_fn for datasets whose samples are uint8 images
+    return to_float_batch(np.stack(samples), ctx=SHARED_CTX)
+
+
+class MemmapImageDataset(gdata.Dataset):
+
+    def __init__(self, path):
+        self.path = path
+        self._data = open_memmap(path)
+
+        # Expose the shape like an NDArray would so that the dataset can be
+        # passed wherever the training scripts expect train_features
+        self.shape = self._data.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        # A single index returns the raw uint8 image so that the DataLoader
+        # can stack them cheaply; the conversion to float happens once per
+        # batch in batchify_fn. A slice returns a float batch directly, which
+        # is what the validation code does with test_features[0:n]
+        if isinstance(idx, slice):
+            return to_float_batch(self._data[idx])
+        return self._data[idx]
+
+    def take(self, rows, ctx=None):
+        # Gather the given rows into one float batch
+        return to_float_batch(self._data[rows], ctx=ctx)
+
+    def to_ndarray(self, ctx=None):
+        # Read the whole dataset into a uint8 NDArray, e.g. to keep it
+        # resident for gather_iterator.GatherIterator
+        return nd.array(np.asarray(self._data), dtype=np.uint8, ctx=ctx)
+
+    def __getstate__(self):
+        # DataLoader worker processes reopen the file instead of receiving
+        # a pickled copy of the mapped array
+        state = self.__dict__.copy()
+        del state['_data']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data = open_memmap(self.path)
+
+    batchify_fn = staticmethod(batchify_uint8)
@@ -0,0 +1,168 @@
+import os
+import numpy as np
+import mxnet as mx
+from mxnet import nd
+from mxnet.gluon import data as gdata
+
+from memmap_dataset import MemmapImageDataset, SHARED_CTX, create_memmap, open_memmap
+
+# A local cache of MNIST so that the MNIST scripts neither download the
+# dataset nor hold a float32 copy of it on every run.
+#
+# The first call of load_mnist downloads MNIST once with
+# mx.test_utils.get_mnist() and writes, for the train and the test split,
+#   mnist_<split>.u8           the images as uint8 (0 - 255) in a memmap file
+#                              (see memmap_dataset.py), 4x smaller than float32
+#   mnist_<split>.bits         the images binarized at 0.5 and bit-packed, 1 bit
+#                              per pixel in a memmap file, 32x smaller than float32
+#   mnist_<split>_labels.npy   the labels as uint8
+# Later calls only open the memmap files. Batches are turned back into
+# float32 with vectorized numpy operations once per batch.
+#
+# The bit-packed images can also be kept resident on a device as they are
+# (PackedImageDataset.to_resident); batches are then gathered with nd.take
+# and unpacked on the device, so the resident copy stays 32x smaller than
+# float32.
+
+MNIST_CACHE_DIR = '../project_data/mnist/'
+MNIST_IMAGE_SHAPE = (1, 28, 28)
+SPLITS = ('train', 'test')
+
+
+def images_path(cache_dir, split, binarized=False):
+    return os.path.join(cache_dir, 'mnist_{}.{}'.format(split, 'bits' if binarized else 'u8'))
+
+
+def labels_path(cache_dir, split):
+    return os.path.join(cache_dir, 'mnist_{}_labels.npy'.format(split))
+
+
+def pack_bits(images):
+    # Binarize float images in [0, 1] at 0.5 and pack every image into
+    # ceil(n_pixels / 8) bytes
+    return np.packbits(images.reshape((images.shape[0], -1)) >= 0.5, axis=1)
+
+
+def unpack_bits(packed, image_shape):
+    # Unpack a batch of bit-packed images into a float32 array of 0s and 1s
+    n_pixels = int(np.prod(image_shape))
+    return np.unpackbits(packed, axis=1)[:, :n_pixels].astype(np.float32).reshape((-1,) + tuple(image_shape))
+
+
+def unpack_bits_ndarray(packed, image_shape, bit_values):
+    # NDArray version of unpack_bits for a batch of bit-packed images on a
+    # device; bit_values is the NDArray [128, 64, ..., 1] of shape (1, 1, 8)
+    # on the same device
+    n_pixels = int(np.prod(image_shape))
+    bits = nd.broadcast_div(packed.astype('float32').reshape((0, -1, 1)), bit_values).floor() % 2
+    return nd.slice_axis(bits.reshape((0, -1)), axis=1, begin=0, end=n_pixels).reshape((-1,) + tuple(image_shape))
+
+
+def build_mnist_cache(cache_dir=MNIST_CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    mnist = mx.test_utils.get_mnist()
+    for split in SPLITS:
+        images = mnist[split + '_data']
+        uint8_images = create_memmap(images_path(cache_dir, split), images.shape)
+        uint8_images[:] = np.rint(images * 255.)
+        uint8_images.flush()
+        packed = pack_bits(images)
+        bit_images = create_memmap(images_path(cache_dir, split, binarized=True), packed.shape)
+        bit_images[:] = packed
+        bit_images.flush()
+        # The labels are written last; their presence marks a complete cache
+        np.save(labels_path(cache_dir, split), mnist[split + '_label'].astype(np.uint8))
+
+
+def load_mnist(split='train', binarized=False, cache_dir=MNIST_CACHE_DIR):
+    # Return the images of a split as a Dataset, along with its labels as a
+    # numpy array; the cache is built on first use
+    if not all(os.path.exists(labels_path(cache_dir, s)) for s in SPLITS):
+        print('[STATE]: Building the MNIST cache in ' + cache_dir)
+        build_mnist_cache(cache_dir)
+    labels = np.load(labels_path(cache_dir, split))
+    if binarized:
+        return PackedImageDataset(images_path(cache_dir, split, binarized=True), MNIST_IMAGE_SHAPE), labels
+    return MemmapImageDataset(images_path(cache_dir, split)), labels
+
+
+class PackedImageDataset(gdata.Dataset):
+
+    def __init__(self, path, image_shape):
+        self.path = path
+        self.image_shape = tuple(image_shape)
+        self._data = open_memmap(path)
+
+        # Expose the shape like an NDArray would so that the dataset can be
+        # passed wherever the training scripts expect train_features
+        self.shape = (self._data.shape[0],) + self.image_shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        # A single index returns the packed row so that samples stay 1 bit
+        # per pixel until batchify_fn unpacks the whole batch at once; a
+        # slice returns a float batch
+        if isinstance(idx, slice):
+            return self.take(np.arange(*idx.indices(len(self))))
+        return self._data[idx]
+
+    def take(self, rows, ctx=None):
+        # Gather the given rows into one float batch
+        return nd.array(unpack_bits(self._data[rows], self.image_shape), ctx=ctx)
+
+    def to_resident(self, ctx=None, rows=None):
+        # Copy the packed images (or the given rows of them) onto ctx as they
+        # are, e.g. to keep them resident for gather_iterator.GatherIterator
+        packed = np.asarray(self._data) if rows is None else self._data[rows]
+        return ResidentPackedImages(nd.array(packed, dtype=np.uint8, ctx=ctx), self.image_shape)
+
+    def batchify_fn(self, samples):
+        return nd.array(unpack_bits(np.stack(samples), self.image_shape), ctx=SHARED_CTX)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_data']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data = open_memmap(self.path)
+
+
+class ResidentPackedImages(object):
+    # Bit-packed images held whole in an NDArray on a device. Batches are
+    # gathered with nd.take and unpacked on that device into float32 0s and
+    # 1s, so only a batch at a time is ever held unpacked
+
+    # gather_iterator.GatherIterator gathers batches with take
+    resident = True
+
+    def __init__(self, packed, image_shape):
+        self.packed = packed
+        self.image_shape = tuple(image_shape)
+        self.context = packed.context
+        self._bit_values = nd.array([128, 64, 32, 16, 8, 4, 2, 1], ctx=self.context).reshape((1, 1, 8))
+
+        # Expose the shape like an NDArray would so that the images can be
+        # passed wherever the training scripts expect train_features
+        self.shape = (packed.shape[0],) + self.image_shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        # A single index returns one unpacked image, a slice a float batch
+        if isinstance(idx, slice):
+            return self.take(np.arange(*idx.indices(len(self))))
+        return self.take([idx])[0]
+
+    def take(self, rows, ctx=None):
+        # Gather the given rows (a list, a numpy array or an NDArray of row
+        # indices) into one float batch
+        if not isinstance(rows, nd.NDArray):
+            rows = nd.array(rows, ctx=self.context)
+        batch = unpack_bits_ndarray(nd.take(self.packed, rows), self.image_shape, self._bit_values)
+        return batch if ctx is None else batch.as_in_context(ctx)
+
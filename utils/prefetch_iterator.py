@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+
+# An iterator that wraps a batch iterable (most likely a gdata.DataLoader)
+# and prepares the next n_prefetch batches in a background thread while the
+# current training step runs. Moving a batch onto the training context also
+# happens in the background, so the training loop only waits when the input
+# pipeline is slower than the model.
+#
+# wait_time accumulates the number of seconds the training loop spent
+# blocked on data; if it stays small compared to the epoch time, the model
+# and not the input pipeline is the bottleneck. With n_prefetch = 0 the
+# batches are produced inline, which measures the wait time of the plain
+# synchronous pipeline for comparison.
+
+# Markers the background thread puts on the queue after the last batch or
+# when producing a batch failed
+_END = object()
+
+
+class _ProducerError(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def _to_ctx(batch, ctx):
+    # Batches are NDArrays, or tuples of them for datasets with labels
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_to_ctx(item, ctx) for item in batch)
+    return batch.as_in_context(ctx)
+
+
+class PrefetchIterator(object):
+
+    def __init__(self, batches, ctx, n_prefetch=2):
+        self.batches = batches
+        self.ctx = ctx
+        self.n_prefetch = n_prefetch
+        self.wait_time = 0.
+
+    def __len__(self):
+        return len(self.batches)
+
+    def reset_wait_time(self):
+        self.wait_time = 0.
+
+    @staticmethod
+    def _put(batch_queue, item, stop_event):
+        # Keep checking the stop event so that a consumer that stops early
+        # does not leave this thread blocked on a full queue forever
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, batch_queue, stop_event):
+        try:
+            for batch in self.batches:
+                if not self._put(batch_queue, _to_ctx(batch, self.ctx), stop_event):
+                    return
+            self._put(batch_queue, _END, stop_event)
+        except Exception as error:
+            self._put(batch_queue, _ProducerError(error), stop_event)
+
+    def _iter_inline(self):
+        batches = iter(self.batches)
+        while True:
+            wait_start = time.time()
+            try:
+                batch = _to_ctx(next(batches), self.ctx)
+            except StopIteration:
+                return
+            finally:
+                self.wait_time += time.time() - wait_start
+            yield batch
+
+    def __iter__(self):
+        if self.n_prefetch == 0:
+            for batch in self._iter_inline():
+                yield batch
+            return
+
+        batch_queue = queue.Queue(maxsize=self.n_prefetch)
+        stop_event = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batch_queue, stop_event))
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                wait_start = time.time()
+                item = batch_queue.get()
+                self.wait_time += time.time() - wait_start
+                if item is _END:
+                    return
+                if isinstance(item, _ProducerError):
+                    raise item.error
+                yield item
+        finally:
+            stop_event.set()
+            producer.join()
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+
+from memmap_dataset import MemmapImageDataset, create_memmap, open_memmap
+
+# Downsampled copies of a memmap dataset for progressive-resolution
+# training. Every level of the pyramid is a memmap file of its own next to
+# the full resolution dataset, e.g. anime_faces_16.u8 and anime_faces_32.u8
+# for anime_faces.u8, whose row i is row i of the full dataset shrunk to
+# size x size. Because the rows line up, a split made with
+# dataset_split.train_test_split on the full dataset path applies to every
+# level.
+#
+# Shrinking averages size x size blocks of the real pixel layout; the
+# result is stored in the same reshaped (n_channels, width, height) layout
+# as the full dataset.
+
+
+def pyramid_path(dataset_path, size):
+    base, extension = os.path.splitext(dataset_path)
+    return '{}_{}{}'.format(base, size, extension)
+
+
+def downsample_uint8(batch, size):
+    # batch is a uint8 array of shape (batch_size, n_channels, width, height)
+    # in the stored layout; width and height must be multiples of size
+    batch_size, n_channels, width, height = batch.shape
+    factor_w = width // size
+    factor_h = height // size
+    pixels = batch.reshape((batch_size, size, factor_w, size, factor_h, n_channels))
+    pixels = pixels.mean(axis=(2, 4), dtype=np.float32)
+    return np.rint(pixels).astype(np.uint8).reshape((batch_size, n_channels, size, size))
+
+
+def write_pyramid(dataset_path, sizes=(16, 32), chunk_size=1024):
+    # Write one downsampled copy of the memmap dataset at dataset_path for
+    # every size, in a single streaming pass over the dataset
+    features = open_memmap(dataset_path)
+    levels = {size: create_memmap(pyramid_path(dataset_path, size),
+                                  (features.shape[0], features.shape[1], size, size))
+              for size in sizes}
+    for start in range(0, features.shape[0], chunk_size):
+        chunk = np.asarray(features[start:start + chunk_size])
+        for size, level in levels.items():
+            level[start:start + chunk_size] = downsample_uint8(chunk, size)
+    for level in levels.values():
+        level.flush()
+
+
+def open_pyramid(dataset_path, sizes=(16, 32)):
+    # Open the levels of the pyramid as datasets, keyed by their size
+    return {size: MemmapImageDataset(pyramid_path(dataset_path, size)) for size in sizes}
@@ -0,0 +1,141 @@
+import json
+import os
+import zlib
+import numpy as np
+from mxnet.gluon import data as gdata
+
+from memmap_dataset import batchify_uint8, to_float_batch
+
+# A sharded record format for image datasets that many DataLoader worker
+# processes can read at random without contending for a shared file.
+#
+# A record directory holds:
+#   records.json        the sample shape and dtype, and the list of shards
+#                       with their number of records and compression
+#   shard_NNNNN.rec     the records of one shard, back to back
+#   shard_NNNNN.idx.npy an array of n_records + 1 byte offsets into the
+#                       shard; record i spans offsets[i] to offsets[i + 1]
+#
+# Each record is one uint8 sample in the (n_channels, width, height)
+# layout. Compression is chosen per shard ('zlib' or None) and applied to
+# every record on its own, so a compressed shard can still be read at
+# random. Readers use os.pread, which does not move a shared file position,
+# so every worker process and thread can read any record at any time.
+
+COMPRESSIONS = (None, 'zlib')
+
+
+def shard_name(shard_index):
+    return 'shard_{:05d}'.format(shard_index)
+
+
+def write_record_shard(record_dir, shard_index, samples, compression=None):
+    # Write the samples (a uint8 array whose first axis indexes the samples)
+    # as one shard and return the shard's entry for records.json
+    if compression not in COMPRESSIONS:
+        raise ValueError('Unknown record compression {}'.format(compression))
+    offsets = np.zeros(len(samples) + 1, dtype=np.uint64)
+    with open(os.path.join(record_dir, shard_name(shard_index) + '.rec'), 'wb') as f:
+        for i, sample in enumerate(samples):
+            record = np.ascontiguousarray(sample).tobytes()
+            if compression == 'zlib':
+                record = zlib.compress(record, 1)
+            f.write(record)
+            offsets[i + 1] = offsets[i] + len(record)
+    np.save(os.path.join(record_dir, shard_name(shard_index) + '.idx.npy'), offsets)
+    return {'name': shard_name(shard_index),
+            'n_records': len(samples),
+            'compression': compression}
+
+
+def write_records_index(record_dir, sample_shape, shards, dtype='uint8'):
+    # Write records.json; it is replaced atomically so that readers never
+    # see a half-written index while a conversion is still adding shards
+    index_path = os.path.join(record_dir, 'records.json')
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump({'sample_shape': [int(n) for n in sample_shape],
+                   'dtype': np.dtype(dtype).name,
+                   'shards': shards}, f)
+    os.replace(index_path + '.tmp', index_path)
+
+
+class RecordDataset(gdata.Dataset):
+
+    def __init__(self, record_dir):
+        self.record_dir = record_dir
+        with open(os.path.join(record_dir, 'records.json'), 'r') as f:
+            index = json.load(f)
+        self.sample_shape = tuple(index['sample_shape'])
+        self.dtype = np.dtype(index['dtype'])
+        self.shards = index['shards']
+
+        # First global record index of every shard, for locating records
+        self._shard_starts = np.cumsum([0] + [shard['n_records'] for shard in self.shards])
+        self._offsets = [np.load(os.path.join(record_dir, shard['name'] + '.idx.npy'))
+                         for shard in self.shards]
+
+        # Shard file descriptors are per process; they are opened lazily so
+        # that every DataLoader worker gets its own
+        self._fds = {}
+        self._fds_pid = None
+
+        # Expose the shape like an NDArray would so that the dataset can be
+        # passed wherever the training scripts expect train_features
+        self.shape = (int(self._shard_starts[-1]),) + self.sample_shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def close(self):
+        # Close the shard file descriptors of this process; they are reopened
+        # when the next record is read. Descriptors inherited from another
+        # process belong to that process and are left alone
+        if self._fds_pid == os.getpid():
+            for fd in self._fds.values():
+                os.close(fd)
+        self._fds = {}
+        self._fds_pid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # __init__ may have failed before the handles were set up
+        if hasattr(self, '_fds'):
+            self.close()
+
+    def _get_fd(self, shard_index):
+        if self._fds_pid != os.getpid():
+            self._fds = {}
+            self._fds_pid = os.getpid()
+        if shard_index not in self._fds:
+            path = os.path.join(self.record_dir, self.shards[shard_index]['name'] + '.rec')
+            self._fds[shard_index] = os.open(path, os.O_RDONLY)
+        return self._fds[shard_index]
+
+    def __getitem__(self, idx):
+        # A single index returns the uint8 sample; a slice returns a float
+        # batch, which is what the validation code does with test_features[0:n]
+        if isinstance(idx, slice):
+            return to_float_batch(np.stack([self[i] for i in range(*idx.indices(len(self)))]))
+        if idx < 0:
+            idx += len(self)
+        shard_index = int(np.searchsorted(self._shard_starts, idx, side='right')) - 1
+        local_idx = idx - self._shard_starts[shard_index]
+        start = int(self._offsets[shard_index][local_idx])
+        stop = int(self._offsets[shard_index][local_idx + 1])
+        record = os.pread(self._get_fd(shard_index), stop - start, start)
+        if self.shards[shard_index]['compression'] == 'zlib':
+            record = zlib.decompress(record)
+        return np.frombuffer(record, dtype=self.dtype).reshape(self.sample_shape)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_fds'] = {}
+        state['_fds_pid'] = None
+        return state
+
+    batchify_fn = staticmethod(batchify_uint8)
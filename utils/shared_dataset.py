@@ -0,0 +1,111 @@
+import json
+import os
+import sys
+import numpy as np
+from mxnet import nd
+
+from memmap_dataset import MemmapImageDataset, create_memmap
+
+# Publishing a dataset once into POSIX shared memory so that concurrent
+# training processes share one copy of it instead of each loading its own.
+#
+# A published dataset is a uint8 memmap file (see memmap_dataset.py) in
+# /dev/shm, the tmpfs that backs POSIX shared memory on Linux. Every process
+# that attaches maps the same pages read-only, so memory does not grow with
+# the number of concurrent runs, and the uint8 copy is 4x smaller than the
+# float32 anime_faces.ndy.
+#
+# The size and modification time of the source file are published with the
+# copy; a process only attaches when they still match the source, so a stale
+# copy left behind by an earlier (or killed) run is never trained on.
+#
+# From the shell:
+#   python utils/shared_dataset.py publish ../project_data/anime_faces.ndy
+#   python utils/shared_dataset.py unpublish anime_faces
+
+SHM_DIR = '/dev/shm'
+
+
+def dataset_name(ndy_path):
+    return os.path.splitext(os.path.basename(ndy_path))[0]
+
+
+def shared_path(name):
+    return os.path.join(SHM_DIR, 'vae_gan_{}.u8'.format(name))
+
+
+def source_path(name):
+    # The signature of the source file a published dataset was made from
+    return shared_path(name) + '.source.json'
+
+
+def source_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def publish(features, name, source=None, chunk_size=1024):
+    # Write features (a float NDArray with values in [0, 1]) into shared
+    # memory as uint8, along with the signature of the source file it was
+    # loaded from. An earlier copy is unpublished first. The data is written
+    # to a temporary file and renamed into place once complete, and only then
+    # is the signature renamed into place, so while the dataset is published
+    # a process finds either no copy, or a copy without a signature (and
+    # loads the source), or the complete copy under its own signature
+    unpublish(name)
+    tmp_path = shared_path(name) + '.tmp'
+    output = create_memmap(tmp_path, features.shape)
+    for start in range(0, features.shape[0], chunk_size):
+        chunk = features[start:start + chunk_size].asnumpy()
+        output[start:start + chunk.shape[0]] = np.rint(chunk * 255.)
+    output.flush()
+    del output
+    os.replace(tmp_path, shared_path(name))
+    with open(source_path(name) + '.tmp', 'w') as f:
+        json.dump(source_signature(source) if source is not None else None, f)
+    os.replace(source_path(name) + '.tmp', source_path(name))
+
+
+def unpublish(name):
+    for path in (shared_path(name), source_path(name)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def attach(name):
+    # Map a published dataset read-only; rows are read straight from the
+    # shared pages
+    return MemmapImageDataset(shared_path(name))
+
+
+def is_current(name, ndy_path):
+    # Whether the published copy of name was made from ndy_path as it is now
+    if not os.path.exists(source_path(name)):
+        return False
+    with open(source_path(name), 'r') as f:
+        return json.load(f) == source_signature(ndy_path)
+
+
+def attach_or_load(ndy_path):
+    # Attach to the published copy of the dataset saved at ndy_path if there
+    # is one and it is current, otherwise load the dataset itself
+    name = dataset_name(ndy_path)
+    if os.path.exists(shared_path(name)):
+        if is_current(name, ndy_path):
+            print('[STATE]: Attached to the shared dataset ' + shared_path(name))
+            return attach(name)
+        print('[STATE]: The shared dataset ' + shared_path(name) + ' is stale, loading ' + ndy_path)
+    return nd.load(ndy_path)[0]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'publish':
+        publish(nd.load(sys.argv[2])[0], dataset_name(sys.argv[2]), sys.argv[2])
+        print('[STATE]: ' + sys.argv[2] + ' published to ' + shared_path(dataset_name(sys.argv[2])))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'unpublish':
+        unpublish(sys.argv[2])
+        print('[STATE]: ' + shared_path(sys.argv[2]) + ' removed')
+    else:
+        print('Usage: python utils/shared_dataset.py publish <dataset.ndy>')
+        print('       python utils/shared_dataset.py unpublish <dataset name>')
+        sys.exit(1)